@@ -0,0 +1,123 @@
+import random
+
+#
+# Synthetic sources
+#
+# Every generator returns a valid program of (roughly) `size` bytes. `density` is the share of statements that carry
+# one of the tokens the zipper has to escape (`*/`, `"""`, `]===]`, `ruby_long_string`), spread over strings,
+# comments, regexes and identifiers. Plain filler statements make up the rest. Same seed, same program.
+#
+
+TOKENS = ["*/", '"""', "]===]", "ruby_long_string"]
+
+
+def _fill(size, density, seed, plain, tokened, header="", footer=""):
+    rng = random.Random(seed)
+    lines = [header] if header else []
+    total = len(header)
+    n = 0
+    while total < size:
+        make = rng.choice(tokened) if rng.random() < density else rng.choice(plain)
+        line = make(n, rng) + "\n"
+        lines.append(line)
+        total += len(line)
+        n += 1
+    if footer:
+        lines.append(footer)
+    return ''.join(lines)
+
+
+def _word(rng):
+    return ''.join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+
+
+PYTHON_PLAIN = [
+    lambda n, r: f"v{n} = {r.randint(0, 999)} + {r.randint(0, 999)}",
+    lambda n, r: f"w{n} = '{_word(r)} {_word(r)}'",
+    lambda n, r: f"def f{n}(x):\n    return x * {r.randint(1, 9)}",
+]
+
+PYTHON_TOKENED = [
+    lambda n, r: f"s{n} = 'a */ {_word(r)} ]===] b'",
+    lambda n, r: f"# {_word(r)} */ ruby_long_string ]===]",
+    lambda n, r: f"d{n} = {{'ruby_long_string': '{_word(r)}'}}",
+    lambda n, r: f"ruby_long_string = {n}",
+    lambda n, r: f"def g{n}():\n    \"\"\"{_word(r)} */ docs\"\"\"\n    return {n}",
+    lambda n, r: f"m{n} = \"\"\"{_word(r)}\n]===] {_word(r)}\"\"\"",
+]
+
+JS_PLAIN = [
+    lambda n, r: f"var v{n} = {r.randint(0, 999)} + {r.randint(0, 999)};",
+    lambda n, r: f"var w{n} = '{_word(r)} {_word(r)}';",
+    lambda n, r: f"function f{n}(x) {{ return x * {r.randint(1, 9)}; }}",
+]
+
+JS_TOKENED = [
+    lambda n, r: f"var s{n} = 'a \"\"\" {_word(r)} ]===] b';",
+    lambda n, r: f"// {_word(r)} \"\"\" ruby_long_string ]===]",
+    lambda n, r: f"/* {_word(r)} \"\"\" ]===] */",
+    lambda n, r: f"var r{n} = /{_word(r)}*/g;",
+    lambda n, r: f"var t{n} = `{_word(r)} \"\"\" ${{{r.randint(0, 9)}}} ruby_long_string`;",
+    lambda n, r: f"var ruby_long_string{n} = {{ruby_long_string: {n}}}.ruby_long_string;",
+]
+
+LUA_PLAIN = [
+    lambda n, r: f"v{n} = {r.randint(0, 999)} + {r.randint(0, 999)}",
+    lambda n, r: f"w{n} = '{_word(r)} {_word(r)}'",
+    lambda n, r: f"function f{n}(x) return x * {r.randint(1, 9)} end",
+]
+
+LUA_TOKENED = [
+    lambda n, r: f"s{n} = 'a */ {_word(r)} \"\"\" b'",
+    lambda n, r: f"-- {_word(r)} */ ruby_long_string \"\"\"",
+    lambda n, r: f"--[[ {_word(r)} */ \"\"\" ]]",
+    lambda n, r: f"l{n} = [==[ {_word(r)} */ ]==]",
+    lambda n, r: f"ruby_long_string{n} = {{ruby_long_string = {n}}}",
+]
+
+RUBY_PLAIN = [
+    lambda n, r: f"v{n} = {r.randint(0, 999)} + {r.randint(0, 999)}",
+    lambda n, r: f"w{n} = '{_word(r)} {_word(r)}'",
+    lambda n, r: f"def f{n}(x)\n  x * {r.randint(1, 9)}\nend",
+]
+
+RUBY_TOKENED = [
+    lambda n, r: f"s{n} = 'a \"\"\" {_word(r)} ]===] b */'",
+    lambda n, r: f"q{n} = \"{_word(r)} */ ]===]\"",
+    lambda n, r: f"c{n} = \"{_word(r)}\"\"\"",
+    lambda n, r: f"e{n} = \"\"\"{_word(r)}\"",
+    lambda n, r: f"r{n} = /{_word(r)}*/",
+    lambda n, r: f"# {_word(r)} \"\"\" */ ]===]",
+    lambda n, r: f"i{n} = 'it''s */'",
+]
+
+
+def python_source(size, density=0.2, seed=0):
+    return _fill(size, density, seed, PYTHON_PLAIN, PYTHON_TOKENED, footer="print('done')\n")
+
+
+def js_source(size, density=0.2, seed=0):
+    return _fill(size, density, seed, JS_PLAIN, JS_TOKENED, footer="console.log('done');\n")
+
+
+def lua_source(size, density=0.2, seed=0):
+    return _fill(size, density, seed, LUA_PLAIN, LUA_TOKENED, footer="print('done')\n")
+
+
+def ruby_source(size, density=0.2, seed=0):
+    return _fill(size, density, seed, RUBY_PLAIN, RUBY_TOKENED, footer="puts 'done'\n")
+
+
+GENERATORS = {
+    "python": python_source,
+    "javascript": js_source,
+    "lua": lua_source,
+    "ruby": ruby_source,
+}
+
+EXTENSIONS = {
+    "python": ".py",
+    "javascript": ".js",
+    "lua": ".lua",
+    "ruby": ".rb",
+}
@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+
+if (cwd := os.getcwd()) not in sys.path:
+    sys.path.insert(0, cwd) # Ensures that will run from the place the project is being called
+    if (script_path := os.path.dirname(os.path.abspath(__file__))) in sys.path:
+            sys.path.remove(script_path)
+
+from bench.generators import EXTENSIONS, GENERATORS
+from main import TEMPLATES, add_zipper_arguments, configure, create_zipper, zipper_options
+from misc import stats
+from misc.syntax_checker import check_commands, in_process_checkers
+from misc.template import load_template
+from misc.verify import CHECKER_LANGUAGES
+
+
+#
+# Zipper benchmark
+#
+# Synthesizes sources of the given sizes and token density, zips them with every template and reports the best and
+# median wall time, throughput and probe counts of each run. Results can be saved as a JSON baseline and later runs
+# compared against it (`--save` / `--compare`).
+#
+# Needs the same interpreters as the zipper itself (`node`, `lua`/`luac`, `ruby`), templates whose languages can't be
+# checked here are skipped.
+#
+
+def missing_checkers(profile):
+    missing = []
+    for language in profile:
+        checker = CHECKER_LANGUAGES[language]
+        if checker not in in_process_checkers and shutil.which(check_commands[checker][0]) is None:
+            missing.append(check_commands[checker][0])
+    return missing
+
+
+def write_sources(directory, profile, size, density, seed):
+    paths = {}
+    for language in profile:
+        paths[language] = os.path.join(directory, f"bench_{size}{EXTENSIONS[language]}")
+        with open(paths[language], "w") as source_file:
+            source_file.write(GENERATORS[language](size, density, seed))
+    return paths
+
+
+def bench_case(name, size, density, seed, repeat):
+    template = TEMPLATES[name]
+    profile = load_template(template).profile
+    case = {"template": name, "size": size, "density": density}
+    if missing := missing_checkers(profile):
+        case["skipped"] = f"missing {', '.join(missing)}"
+        return case
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_sources(directory, profile, size, density, seed)
+        input_bytes = sum(os.path.getsize(path) for path in paths.values())
+        timings = []
+        for _ in range(repeat):
+            stats.reset()
+            started = time.perf_counter()
+            answer = create_zipper(paths.get("python", ""), paths.get("javascript", ""),
+                                   paths.get("lua", ""), paths.get("ruby", ""), template)
+            timings.append(time.perf_counter() - started)
+
+    # Counters of the last run, every run does the same work
+    report = stats.snapshot()
+    best = min(timings)
+    case.update({
+        "input_bytes": input_bytes,
+        "output_bytes": len(answer.encode("utf-8", "surrogateescape")),
+        "best_seconds": round(best, 6),
+        "median_seconds": round(statistics.median(timings), 6),
+        "throughput_kb_s": round(input_bytes / 1024 / best, 2) if best else None,
+        "probes": report["probes"],
+        "total_probes": sum(report["probes"].values()),
+        "checks": {key: value["count"] for key, value in report["checks"].items()},
+        "subprocesses": report["subprocesses"],
+    })
+    return case
+
+
+def case_key(case):
+    return f"{case['template']}/{case['size']}/{case['density']}"
+
+
+def compare(results, baseline):
+    previous = {case_key(case): case for case in baseline["results"]}
+    lines = []
+    for case in results:
+        old = previous.get(case_key(case))
+        if "skipped" in case or old is None or "skipped" in old:
+            continue
+        ratio = case["best_seconds"] / old["best_seconds"] if old["best_seconds"] else float("inf")
+        lines.append(f"{case_key(case):<24} {old['best_seconds']:>9.3f}s -> {case['best_seconds']:>9.3f}s "
+                     f"(x{ratio:.2f})  probes {old['total_probes']} -> {case['total_probes']}")
+    return lines
+
+
+def get_input():
+    parser = argparse.ArgumentParser(description="Benchmark create_zipper on synthetic sources.")
+    parser.add_argument("--templates", default="two,three,four", help="Comma separated templates (two,three,four)")
+    parser.add_argument("--sizes", default="4096,65536", help="Comma separated source sizes, in bytes per language")
+    parser.add_argument("--density", type=float, default=0.2, help="Share of statements carrying a token")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic sources")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case")
+    parser.add_argument("--save", default=None, help="Write the results as a JSON baseline to this path")
+    parser.add_argument("--compare", default=None, help="JSON baseline to compare the results against")
+    add_zipper_arguments(parser)
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.templates.split(",") if name.strip()]
+    if any(name not in TEMPLATES for name in names) or args.repeat < 1:
+        raise Exception("Invalid input")
+    return names, [int(size) for size in args.sizes.split(",")], args
+
+
+if __name__ == "__main__":
+    templates, sizes, args = get_input()
+    options = zipper_options(args)
+    configure(options)
+
+    results = []
+    for name in templates:
+        for size in sizes:
+            case = bench_case(name, size, args.density, args.seed, args.repeat)
+            results.append(case)
+            if "skipped" in case:
+                print(f"{case_key(case):<24} skipped ({case['skipped']})")
+            else:
+                print(f"{case_key(case):<24} best {case['best_seconds']:>9.3f}s  median {case['median_seconds']:>9.3f}s  "
+                      f"{case['throughput_kb_s']:>10.1f} KB/s  {case['total_probes']:>6} probes")
+
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            print("\n".join(compare(results, json.load(baseline_file))))
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump({"settings": {"density": args.density, "seed": args.seed, "repeat": args.repeat,
+                                    "options": options, "python": sys.version.split()[0]},
+                       "results": results}, baseline_file, indent=2)
+
+    exit(0)
@@ -1,7 +1,68 @@
 import argparse
+import contextlib
+import json
+import locale
+import mmap
+import os
 import sys
 
-from misc.syntax_checker import generic_token_replacement, reformat_strings_and_replace_tokens
+from misc.async_checker import run_with_async_checks
+from misc.batch import load_batch, run_batch
+from misc.checker_pool import set_pool_size
+from misc.escaping import blanket_escapes, escape_tokens, iter_escaped
+from misc.minimizer import minimize_sections, minimizer_settings, set_minimize
+from misc.plan import EscapePlan, load_plan, plan_source, using_plan
+from misc.probe_cache import get_cache, open_cache
+from misc.scheduler import run_sections, set_section_jobs
+from misc.server import serve, server_settings, zip_remote
+from misc.stats import emit, phase, snapshot, to_json, to_text
+from misc.syntax_checker import classifier_modes, generic_token_replacement, incremental_fixpoint, probe_strategies, \
+    reformat_strings_and_replace_tokens, set_classifier, set_probe_jobs, set_probe_strategy, set_windowed_probes
+from misc.template import load_template
+from misc.verify import format_report, verify
+from misc.watch import watch
+
+
+def add_zipper_arguments(parser):
+    parser.add_argument("--jobs", type=int, default=1, help="Number of syntax probes to run concurrently")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="Warm checker processes per language (0 launches one process per check, "
+                             "defaults to the number of jobs)")
+    parser.add_argument("--classifier", default="probe", choices=classifier_modes,
+                        help="How token occurrences are classified: compiler probes, lexer (probing only ambiguous "
+                             "occurrences) or crosscheck (lexer decisions verified against probes)")
+    parser.add_argument("--strategy", default="single", choices=probe_strategies,
+                        help="Probe one occurrence per compilation (single) or bisect batches of them (bisect)")
+    parser.add_argument("--window", action="store_true",
+                        help="Compile only the top-level statements around each occurrence when probing large sources")
+    parser.add_argument("--section-jobs", type=int, default=4,
+                        help="Number of language sections zipped at once, across every zip in the process")
+    parser.add_argument("--minimize", action="store_true",
+                        help="Strip comments and blank lines and shorten escapes in every section, keeping only the "
+                             "changes its checker still accepts")
+    parser.add_argument("--cache-dir", default=None, help="Directory for the persistent probe verdict cache")
+    parser.add_argument("--cache-size", type=int, default=100000,
+                        help="Maximum number of cached probe verdicts (least recently used are evicted first)")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print per-phase timings, probe counts and checker latencies to stderr when done")
+    parser.add_argument("--stats-json", default=None, help="Write the same statistics as JSON to this path")
+
+
+def zipper_options(args):
+    return {
+        "jobs": args.jobs,
+        "classifier": args.classifier,
+        "strategy": args.strategy,
+        "window": args.window,
+        "section_jobs": args.section_jobs,
+        "minimize": args.minimize,
+        "cache_dir": args.cache_dir,
+        "cache_size": args.cache_size,
+        "pool_size": args.pool_size if args.pool_size is not None else args.jobs,
+        "stats": args.stats,
+        "stats_json": args.stats_json,
+    }
+
 
 def get_input():
     parser = argparse.ArgumentParser(description="Process two files into one.")
@@ -9,205 +70,441 @@ def get_input():
     parser.add_argument("js_file", nargs="?", help="Path to the javascript file")
     parser.add_argument("lua_file", default="", nargs="?", help="Path to the python file")
     parser.add_argument("ruby_file", default="", nargs="?", help="Path to the javascript file")
-    parser.add_argument("--output", default=None, help="Optional output file path")
+    parser.add_argument("--output", default=None, help="Optional output file path (output directory in batch mode)")
+    parser.add_argument("--batch", default=None,
+                        help="Zip every program set of a manifest (JSON/CSV lines) or directory in one process")
+    parser.add_argument("--batch-jobs", type=int, default=1, help="Number of program sets zipped concurrently")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and re-zip into --output every time an input changes")
+    parser.add_argument("--connect", default=None,
+                        help="Zip through a running `main.py serve` daemon (socket path or [host:]port) instead")
+    parser.add_argument("--plan-out", default=None,
+                        help="Write every escaping decision (and the hash of every source) to this plan file")
+    parser.add_argument("--plan-in", default=None,
+                        help="Replay the decisions of a plan file instead of probing, failing if a source changed")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write the output in chunks as it is built, escaping unprobed sections straight from "
+                             "memory-mapped sources (for very large inputs)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the output with the syntax checker of every language in the template, at once")
+    parser.add_argument("--verify-run", action="store_true",
+                        help="Also run the original programs and the output with every interpreter and diff them")
+    parser.add_argument("--verify-timeout", type=float, default=30.0, help="Seconds before a verification is killed")
+    parser.add_argument("--verify-json", default=None, help="Write the verification report as JSON to this path")
+    add_zipper_arguments(parser)
     args = parser.parse_args()
 
-    _python_file = args.python_file if args.python_file else input("Enter the path for the first file: ").strip()
-    _js_file = args.js_file if args.js_file else input("Enter the path for the second file: ").strip()
+    if args.batch and not args.output:
+        raise Exception("Invalid input (batch mode needs an --output directory)")
+    if args.watch and not args.output:
+        raise Exception("Invalid input (watch mode needs an --output file)")
+
+    _python_file = args.python_file if args.python_file or args.batch else input("Enter the path for the first file: ").strip()
+    _js_file = args.js_file if args.js_file or args.batch else input("Enter the path for the second file: ").strip()
     _lua_file = args.lua_file
     _ruby_file = args.ruby_file
     _output = args.output
-
-    if not all([_js_file, _python_file]) or (_ruby_file and not _lua_file):
+    _options = {
+        **zipper_options(args),
+        "batch": args.batch,
+        "batch_jobs": args.batch_jobs,
+        "watch": args.watch,
+        "connect": args.connect,
+        "stream": args.stream,
+        "plan_in": args.plan_in,
+        "plan_out": args.plan_out,
+        "verify": args.verify or args.verify_run or bool(args.verify_json),
+        "verify_run": args.verify_run,
+        "verify_timeout": args.verify_timeout,
+        "verify_json": args.verify_json,
+    }
+
+    if (args.plan_in or args.plan_out) and (args.connect or args.batch):
+        raise Exception("Invalid input (plans can't be combined with --connect or --batch)")
+    if args.stream and (args.connect or args.watch or args.batch or _options["verify"]):
+        raise Exception("Invalid input (--stream can't be combined with --connect, --watch, --batch or --verify)")
+
+    if not args.batch and (not all([_js_file, _python_file]) or (_ruby_file and not _lua_file)):
         raise Exception("Invalid input")
 
-    return _python_file, _js_file, _lua_file, _ruby_file, _output
+    return _python_file, _js_file, _lua_file, _ruby_file, _output, _options
+
+
+def get_serve_input():
+    parser = argparse.ArgumentParser(prog="main.py serve", description="Serve zip requests from a long-running process.")
+    parser.add_argument("--listen", default="zipper.sock",
+                        help="Unix socket path, or [host:]port to serve HTTP over TCP (localhost by default)")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="Number of zips running at once")
+    parser.add_argument("--max-queued", type=int, default=64,
+                        help="Number of requests waiting for their turn before new ones are turned away")
+    add_zipper_arguments(parser)
+    args = parser.parse_args(sys.argv[2:])
+    return args.listen, {**zipper_options(args), "max_in_flight": args.max_in_flight, "max_queued": args.max_queued}
+
+
+def configure(options):
+    set_pool_size(options["pool_size"])
+    set_probe_jobs(options["jobs"])
+    set_classifier(options["classifier"])
+    set_probe_strategy(options["strategy"])
+    set_windowed_probes(options["window"])
+    set_section_jobs(options["section_jobs"])
+    set_minimize(options["minimize"])
+    if options["cache_dir"]:
+        open_cache(options["cache_dir"], options["cache_size"])
+
+
+def report_stats(options):
+    if options["minimize"] and not options.get("connect"):
+        sys.stderr.write(f"Minimized: saved {snapshot()['bytes'].get('minimize_saved', 0)} bytes\n")
+    if not (options["stats"] or options["stats_json"]):
+        return
+    extra = {}
+    if (cache := get_cache()) is not None:
+        extra["cache"] = {"hits": cache.hits, "misses": cache.misses, "evictions": cache.evictions}
+    if options["stats"]:
+        sys.stderr.write(to_text(extra))
+    if options["stats_json"]:
+        with open(options["stats_json"], "w") as stats_file:
+            stats_file.write(to_json(extra))
+
+
+TEMPLATES = {
+    "two": "templates/two.zipped.template",
+    "three": "templates/three.zipped.template",
+    "four": "templates/four.zipped.template",
+}
+
+
+def verify_output(zipped, template_file, sources, options) -> bool:
+    """Verifies a zip as asked by the options, reporting to stderr. Returns whether it passed."""
+    originals = dict(zip(["python", "javascript", "lua", "ruby"], sources)) if options["verify_run"] else None
+    report = verify(zipped, profile_template(template_file), originals, options["verify_timeout"])
+    sys.stderr.write(format_report(report))
+    if options["verify_json"]:
+        with open(options["verify_json"], "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    return report["ok"]
+
+
+def new_plan(options):
+    if options["plan_in"]:
+        return load_plan(options["plan_in"])
+    return EscapePlan() if options["plan_out"] else None
+
+
+def save_plan(plan, options):
+    if plan is not None and options["plan_out"]:
+        with open(options["plan_out"], "w") as plan_file:
+            plan_file.write(plan.to_json())
+
+
+def select_template_name(lua_file, ruby_file):
+    match [lua_file, ruby_file]:
+        case ['', '']:
+            return "two"
+        case [_, '']:
+            return "three"
+        case[_, _]:
+            return "four"
+        case _:
+            return ""
+
+
+def select_template(lua_file, ruby_file):
+    return TEMPLATES.get(select_template_name(lua_file, ruby_file), "")
 
 
 def profile_template(template_file):
-    languages = [('python','<PYTHON CODE>'),('lua', '<LUA CODE>'),('javascript','<JS CODE>'), ("ruby","<RUBY CODE>")]
-    profile = {}
-    with open(template_file, "r") as template:
-        template_str = template.read()
-
-    parts = template_str.split("<DIVISION>")
-    for n,part in enumerate(parts):
-        total = 0
-        for lan,tag in languages:
-            if tag in part:
-                if lan in profile:
-                    raise Exception(f'TEMPLATE ERROR: Same tag ({tag}) appears more than once. (Found on {profile[lan]} and {n}))')
-                profile[lan] = n
-                total += 1
-        if total == 0:
-            raise Exception(f'TEMPLATE ERROR: Tag-less piece of code. \n (Division number {n})')
-        if total > 1:
-            raise Exception(f'TEMPLATE ERROR: One division has more than one tag. \n (Division number {n})')
-
-    sorted_profile = [l for _,l in sorted([(n,l) for l,n in profile.items()])]
-   
-    return sorted_profile
+    return load_template(template_file).profile
 
 
-def create_zipper(python_file, js_file, lua_file, ruby_file, template_file):
+class Source(str):
+    """Program text given instead of a path, zipped as is without touching the disk."""
 
-    profile = profile_template(template_file)
 
-    with open(template_file, "r") as template:
-        template_str = template.read()
-        if template_str[0] == "~":
-            template_str = '\n'.join(template_str.split('\n')[1:])
+def read_source(source_file):
+    if isinstance(source_file, Source):
+        return str(source_file)
+    if source_file == '':
+        return ''
+    with open(source_file, "r") as _source_file:
+        return _source_file.read()
 
-    ruby_token = "ruby_long_string" if "ruby" in profile else ""
-    parts = template_str.split("<DIVISION>")
 
-    code = []
+def ruby_stages(ruby_code):
+    with phase("probe", "ruby"):
+        # Remove triple quotes inside single quotes
+        ruby_code, _ = reformat_strings_and_replace_tokens(
+                ruby_code, "ruby",
+                '"""',
+                "'",
+                '"""',
+                '\"\'+\'\"\'+\'\"',
+                False,
+                [])
 
-    for n, language in enumerate(profile): 
-        current_part = parts[n]
-        if language == "python":
-            if python_file != '':
-                with open(python_file, "r") as _py_file:
-                    python_code = _py_file.read()
-            else:
-                python_code = ''
+        # Replace triple quotes inside strings
+        ruby_code = ruby_code.replace('"""', '\\x22\\x22\\x22')
 
-            python_code = python_code.replace("*/", "\\x2A/")
-            python_code = python_code.replace(']===]', ']=\\x3D=]')
-            python_code = generic_token_replacement(python_code, "py", ruby_token)
-            code.append(current_part.replace("<PYTHON CODE>", python_code))
+        # Replace Lua end, inside single quotes
+        ruby_code, _ = reformat_strings_and_replace_tokens(
+                ruby_code, "ruby",
+                ']===]',
+                "'",
+                ']===]',
+                ']==\'+\'=]',
+                False,
+                [])
 
+        # Replace Lua end, inside strings
+        ruby_code = ruby_code.replace(']===]', ']=\\x3D=]')
+
+        # Replace JS end, inside single quotes
+        ruby_code, _ = reformat_strings_and_replace_tokens(
+            ruby_code, "ruby",
+            '*/',
+            "'/",
+            '*/',
+            '*\'+\'/',
+            False,
+            [])
+
+        # Replace JS end, at the end of a regex
+        # TODO: look for an alternative to this, as this kills equality between 2 equal regexes
+        ruby_code, _ = reformat_strings_and_replace_tokens(
+            ruby_code, "ruby",
+            '*/',
+            "*",
+            '*/',
+            '{0,}/',
+            False,
+            [])
+
+        # Replace JS end, inside Strings
+        ruby_code = ruby_code.replace("*/", "\\x2A/")
+    return ruby_code
+
+
+# Rough cost of a section per source byte, Ruby goes through the fixpoint and four more probing stages
+SECTION_WEIGHTS = {"python": 1, "javascript": 1, "lua": 1, "ruby": 5}
+
+
+def section_cost(language, source_file):
+    if isinstance(source_file, Source):
+        size = len(source_file)
+    else:
+        size = os.path.getsize(source_file) if source_file and os.path.exists(source_file) else 0
+    return size * SECTION_WEIGHTS.get(language, 1)
+
+
+def zip_section(language, source_file, template):
+    """Reads, escapes and probes one section, returning its code (the caller fills the template in)."""
+    ruby_token = template.ruby_token
+
+    if language == "python":
+        with phase("read", "python"):
+            python_code = read_source(source_file)
+        plan_source("python", python_code)
+
+        with phase("escape", "python"):
+            python_code = escape_tokens(python_code, blanket_escapes(template.forbidden["python"]))
+        with phase("probe", "python"):
+            python_code = generic_token_replacement(python_code, "py", ruby_token)
+        return python_code
 
-        elif language == "javascript":
-            if js_file != '':
-                with open(js_file, "r") as _js_file:
-                    js_code = _js_file.read()
-            else:
-                js_code = ''
+    elif language == "javascript":
+        with phase("read", "javascript"):
+            js_code = read_source(source_file)
+        plan_source("javascript", js_code)
 
-            js_code = js_code.replace('"""', '\\x22\\x22\\x22')
-            js_code = js_code.replace(']===]', ']=\\x3D=]')
+        with phase("escape", "javascript"):
+            js_code = escape_tokens(js_code, blanket_escapes(template.forbidden["javascript"]))
+        with phase("probe", "javascript"):
             js_code = generic_token_replacement(js_code, "javascript", ruby_token)
-            code.append(current_part.replace("<JS CODE>", js_code))
+        return js_code
 
-        elif language == "lua":
-            if lua_file != '':
-                with open(lua_file, "r") as _lua_file:
-                    lua_code = _lua_file.read()
-            else:
-                lua_code = ''
+    elif language == "lua":
+        with phase("read", "lua"):
+            lua_code = read_source(source_file)
+        plan_source("lua", lua_code)
 
-            lua_code = lua_code.replace('"""', '\\x22\\x22\\x22')
-            lua_code = lua_code.replace("*/", "\\x2A/")
+        with phase("escape", "lua"):
+            lua_code = escape_tokens(lua_code, blanket_escapes(template.forbidden["lua"]))
+        with phase("probe", "lua"):
             lua_code = generic_token_replacement(lua_code, "lua", ruby_token)
-            code.append(current_part.replace("<LUA CODE>", lua_code))
-
-        elif language == "ruby":
-            if ruby_file != '':
-                with open(ruby_file, "r") as _ruby_file:
-                    ruby_code = _ruby_file.read()
-            else:
-                ruby_code = ''
-
-            # Remove stacked empty comments
-            previous_ruby_code = ""
-            while previous_ruby_code != ruby_code:
-                previous_ruby_code = ruby_code
-                # From left
-                ruby_code, _ = reformat_strings_and_replace_tokens(
-                    ruby_code, "ruby",
-                    '"""',
-                    '2"""',
-                    '"""',
-                    '""+"',
-                    False,
-                    [])
-
-                # From right
-                ruby_code, _ = reformat_strings_and_replace_tokens(
-                    ruby_code, "ruby",
-                    '"""',
-                    '"""2',
-                    '"""',
-                    '"+""',
-                    False,
-                    [])
-
-            # Remove triple quotes inside single quotes
-            ruby_code, _ = reformat_strings_and_replace_tokens(
-                    ruby_code, "ruby",
-                    '"""',
-                    "'",
-                    '"""',
-                    '\"\'+\'\"\'+\'\"',
-                    False,
-                    [])
-
-            # Replace triple quotes inside strings
-            ruby_code = ruby_code.replace('"""', '\\x22\\x22\\x22')
-
-            # Replace Lua end, inside single quotes
-            ruby_code, _ = reformat_strings_and_replace_tokens(
-                    ruby_code, "ruby",
-                    ']===]',
-                    "'",
-                    ']===]',
-                    ']==\'+\'=]',
-                    False,
-                    [])
-
-            # Replace Lua end, inside strings
-            ruby_code = ruby_code.replace(']===]', ']=\\x3D=]')
-
-            # Replace JS end, inside single quotes
-            ruby_code, _ = reformat_strings_and_replace_tokens(
-                ruby_code, "ruby",
-                '*/',
-                "'/",
-                '*/',
-                '*\'+\'/',
-                False,
-                [])
+        return lua_code
 
-            # Replace JS end, at the end of a regex
-            # TODO: look for an alternative to this, as this kills equality between 2 equal regexes
-            ruby_code, _ = reformat_strings_and_replace_tokens(
-                ruby_code, "ruby",
-                '*/',
-                "*",
-                '*/',
-                '{0,}/',
-                False,
-                [])
+    elif language == "ruby":
+        with phase("read", "ruby"):
+            ruby_code = read_source(source_file)
+        plan_source("ruby", ruby_code)
 
-            # Replace JS end, inside Strings
-            ruby_code = ruby_code.replace("*/", "\\x2A/")
+        # Remove stacked empty comments, from left and from right
+        with phase("fixpoint", "ruby"):
+            ruby_code = incremental_fixpoint(ruby_code, "ruby", '"""', [('2"""', '""+"'), ('"""2', '"+""')])
 
-            code.append(current_part.replace("<RUBY CODE>", ruby_code))
+        ruby_code = ruby_stages(ruby_code)
 
-        else:
-            raise Exception(f"ZIPPER ERROR: Invalid language ({language})")
+        return ruby_code
 
-    return ''.join(code)
+    else:
+        raise Exception(f"ZIPPER ERROR: Invalid language ({language})")
 
 
-if __name__ == "__main__":
-    py_path, js_path, l_file, r_file, output = get_input()
+def create_zipper(python_file, js_file, lua_file, ruby_file, template_file):
+
+    with phase("template"):
+        template = load_template(template_file)
+    sources = {"python": python_file, "javascript": js_file, "lua": lua_file, "ruby": ruby_file}
+
+    # Sections are independent until assembled, the most expensive ones start first
+    codes = run_sections([
+        (section_cost(language, sources.get(language)), zip_section, (language, sources.get(language), template))
+        for language in template.profile])
+    if minimizer_settings['enabled']:
+        codes = minimize_sections(codes, template)
+
+    with phase("assemble"):
+        return ''.join(template.fill(n, code) for n, code in enumerate(codes))
+
+
+def _streamable(language, source_file, data, template):
+    # Sections that need no probing (nor minimizing) can go straight from the mapped file to the output. Text mode
+    # reads translate newlines and decode with the locale encoding, so only UTF-8 sources without `\r` give the same
+    # bytes.
+    return language != "ruby" and not minimizer_settings['enabled'] and not isinstance(source_file, Source) and \
+        data.find(b"\r") < 0 and \
+        (not template.ruby_token or data.find(template.ruby_token.encode()) < 0) and \
+        locale.getpreferredencoding(False).lower().replace("-", "") == "utf8"
+
+
+@contextlib.contextmanager
+def mapped_source(source_file):
+    """The bytes of a source file, memory-mapped when possible."""
+    if isinstance(source_file, Source) or source_file == '' or os.path.getsize(source_file) == 0:
+        yield str(source_file).encode("utf-8", "surrogateescape") if isinstance(source_file, Source) else b""
+        return
+    with open(source_file, "rb") as _source_file:
+        with mmap.mmap(_source_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def iter_zipper(python_file, js_file, lua_file, ruby_file, template_file):
+    """
+    create_zipper as a generator of bytes chunks, for sources too large to hold the polyglot (and the copies made
+    building it) in memory. Sections that need no probing are escaped straight from the mapped source files.
+    """
+    with phase("template"):
+        template = load_template(template_file)
+    sources = {"python": python_file, "javascript": js_file, "lua": lua_file, "ruby": ruby_file}
+
+    with contextlib.ExitStack() as stack:
+        mapped = {language: stack.enter_context(mapped_source(sources.get(language))) for language in template.profile}
+        streamed = {language for language in template.profile
+                    if _streamable(language, sources.get(language), mapped[language], template)}
+        for language in streamed:
+            plan_source(language, mapped[language])
+        # Sections that are probed are zipped whole (concurrently), everything else is streamed in order
+        probed = [language for language in template.profile if language not in streamed]
+        codes = run_sections([(section_cost(language, sources.get(language)), zip_section,
+                               (language, sources.get(language), template)) for language in probed])
+        if minimizer_settings['enabled']:
+            # Nothing is streamed when minimizing
+            codes = minimize_sections(codes, template)
+        zipped = dict(zip(probed, codes))
+
+        for n, language in enumerate(template.profile):
+            if language not in streamed:
+                yield template.fill(n, zipped.pop(language)).encode()
+                continue
+            replacements = blanket_escapes(template.forbidden[language])
+            pieces = template.pieces[n]
+            for i, piece in enumerate(pieces):
+                yield piece.encode()
+                if i < len(pieces) - 1:
+                    yield from iter_escaped(mapped[language], replacements)
+
+
+def zip_texts(python_code, js_code, lua_code="", ruby_code="", template_name=None):
+    """Zips source texts, with a template by name (two, three or four) or picked from the sources given."""
+    template_name = template_name or select_template_name(lua_code, ruby_code)
+    if template_name not in TEMPLATES:
+        raise Exception(f"Invalid input (unknown template {template_name})")
+    return create_zipper(Source(python_code), Source(js_code), Source(lua_code), Source(ruby_code),
+                         TEMPLATES[template_name])
+
+
+async def create_zipper_async(python_file, js_file, lua_file, ruby_file, template_file):
+    """create_zipper for event loops, checkers run as asyncio subprocesses and cancelling the call kills them."""
+    return await run_with_async_checks(create_zipper, python_file, js_file, lua_file, ruby_file, template_file)
 
-    match [l_file, r_file]:
-        case ['', '']:
-            template = "templates/two.zipped.template"
-        case [_, '']:
-            template = "templates/three.zipped.template"
-        case[_, _]:
-            template = "templates/four.zipped.template"
-        case _:
-            template = ""
 
-    answer = create_zipper(py_path, js_path, l_file, r_file, template)
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["serve"]:
+        address, options = get_serve_input()
+        configure(options)
+        server_settings["max_in_flight"] = options["max_in_flight"]
+        server_settings["max_queued"] = options["max_queued"]
+        serve(address, zip_texts, log=sys.stderr.write)
+        report_stats(options)
+        exit(0)
+
+    py_path, js_path, l_file, r_file, output, options = get_input()
+
+    configure(options)
+
+    if options["batch"]:
+        summary = run_batch(load_batch(options["batch"]), output, create_zipper, select_template,
+                            options["batch_jobs"], sys.stderr.write)
+        sys.stderr.write(f"Zipped {summary['total'] - summary['failures']}/{summary['total']} program sets "
+                         f"in {summary['seconds']:.3f}s\n")
+        report_stats(options)
+        exit(1 if summary["failures"] else 0)
+
+    template = select_template(l_file, r_file)
+
+    if options["watch"]:
+        def build():
+            with using_plan(new_plan(options)) as plan:
+                zipped = create_zipper(py_path, js_path, l_file, r_file, template)
+            save_plan(plan, options)
+            with open(output, "w") as watched_file:
+                watched_file.write(zipped)
+            emit("bytes", kind="output", count=len(zipped.encode("utf-8", "surrogateescape")))
+            if options["verify"]:
+                verify_output(zipped, template, [py_path, js_path, l_file, r_file], options)
+
+        watch([py_path, js_path, l_file, r_file, template], build, log=sys.stderr.write)
+        report_stats(options)
+        exit(0)
+
+    if options["stream"]:
+        written = 0
+        with open(output, "wb") if output else contextlib.nullcontext(sys.stdout.buffer) as out_file, \
+                using_plan(new_plan(options)) as plan:
+            for chunk in iter_zipper(py_path, js_path, l_file, r_file, template):
+                out_file.write(chunk)
+                written += len(chunk)
+        save_plan(plan, options)
+        emit("bytes", kind="output", count=written)
+        report_stats(options)
+        exit(0)
+
+    if options["connect"]:
+        answer = zip_remote(options["connect"], read_source(py_path), read_source(js_path), read_source(l_file),
+                            read_source(r_file), select_template_name(l_file, r_file))
+    else:
+        with using_plan(new_plan(options)) as plan:
+            answer = create_zipper(py_path, js_path, l_file, r_file, template)
+        save_plan(plan, options)
 
     with open(output, "w") if output else sys.stdout as out_file:
         out_file.write(answer)
+    emit("bytes", kind="output", count=len(answer.encode("utf-8", "surrogateescape")))
+
+    verified = not options["verify"] or verify_output(answer, template, [py_path, js_path, l_file, r_file], options)
 
-    exit(0)
+    report_stats(options)
+    exit(0 if verified else 1)
 
@@ -0,0 +1,121 @@
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import threading
+import weakref
+
+from misc.stats import emit
+from misc.syntax_checker import check_commands, check_router, check_suffixes, memfd_commands, stdin_commands
+
+#
+# Asyncio checkers
+#
+# The zipping pipeline stays synchronous and runs in a worker thread, but while it runs for `run_with_async_checks`
+# every syntax check it needs is handed back to the event loop, where the checker runs as an asyncio subprocess. A
+# semaphore per event loop caps the number of checkers alive at once, across every zip running on that loop.
+# Cancelling the zip kills the checkers in flight and stops the pipeline at its next check.
+#
+
+async_settings = {
+    'limit': 4,
+}
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def set_async_limit(limit:int) -> None:
+    """Sets the number of checker processes alive at once per event loop (applies to loops that haven't zipped yet)."""
+    async_settings['limit'] = max(1, limit)
+
+
+def _semaphore(loop):
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(async_settings['limit'])
+    return _semaphores[loop]
+
+
+async def check_source_async(language:str, source:str) -> bool:
+    data = source.encode("utf-8", "surrogateescape")
+    emit("bytes", kind="probe_input", count=len(data))
+    async with _semaphore(asyncio.get_running_loop()):
+        fd = None
+        scratch = None
+        if language in stdin_commands:
+            command, stdin = [*stdin_commands[language], "-"], data
+        elif hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd"):
+            fd = os.memfd_create(f"probe{check_suffixes.get(language, '.txt')}")
+            with open(fd, "wb", closefd=False) as memory_file:
+                memory_file.write(data)
+            command = [*memfd_commands.get(language, check_commands[language]), f"/proc/self/fd/{fd}"]
+            stdin = None
+        else:
+            handle, scratch = tempfile.mkstemp(prefix="probe", suffix=check_suffixes.get(language, '.txt'))
+            with open(handle, "wb") as scratch_file:
+                scratch_file.write(data)
+            command, stdin = [*check_commands[language], scratch], None
+
+        emit("subprocess", language=command[0], kind="check")
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *command, stdin=asyncio.subprocess.PIPE if stdin is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+                pass_fds=(fd,) if fd is not None else ())
+            try:
+                await process.communicate(stdin)
+            except asyncio.CancelledError:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                raise
+            return process.returncode == 0
+        finally:
+            if fd is not None:
+                os.close(fd)
+            if scratch is not None:
+                os.remove(scratch)
+
+
+class AsyncRouter:
+    """Runs the checks of a zip on an event loop, on behalf of the pipeline thread (see `check_router`)."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.cancelled = False
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def checkpoint(self):
+        if self.cancelled:
+            raise concurrent.futures.CancelledError()
+
+    def check(self, language:str, source:str) -> bool:
+        with self._lock:
+            self.checkpoint()
+            future = asyncio.run_coroutine_threadsafe(check_source_async(language, source), self.loop)
+            self._pending.add(future)
+        try:
+            return future.result()
+        finally:
+            with self._lock:
+                self._pending.discard(future)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            for future in self._pending:
+                future.cancel()
+
+
+async def run_with_async_checks(function, *args):
+    """Awaits `function(*args)` in a worker thread, running every syntax check it makes on the current event loop."""
+    router = AsyncRouter(asyncio.get_running_loop())
+    token = check_router.set(router)
+    try:
+        # The worker thread gets a copy of the current context, router included
+        return await asyncio.to_thread(function, *args)
+    except asyncio.CancelledError:
+        router.cancel()
+        raise
+    finally:
+        check_router.reset(token)
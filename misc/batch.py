@@ -0,0 +1,121 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from misc.stats import emit
+
+#
+# Batch zipping
+#
+# Zips many program sets in a single process, so templates, checker pools and probe caches stay warm between them.
+# Sets come either from a directory (files sharing a basename, like the test engine's cases) or from a manifest with
+# one set per line, as JSON objects or CSV rows:
+#
+#   {"name": "hello", "python": "hello.py", "js": "hello.js", "lua": "hello.lua", "ruby": "hello.rb"}
+#   hello,hello.py,hello.js,hello.lua,hello.rb
+#
+# Relative paths in a manifest are relative to the manifest itself.
+#
+
+BATCH_FIELDS = ["name", "python", "js", "lua", "ruby"]
+SUMMARY_FILE = "summary.json"
+OUTPUT_SUFFIX = ".zipped"
+
+
+def _script_names(directory, extension):
+    return {f[:-len(extension)] for f in os.listdir(directory) if f.endswith(extension)}
+
+
+def load_directory(directory:str) -> list:
+    items = []
+    python_names = _script_names(directory, ".py")
+    lua_names = _script_names(directory, ".lua")
+    ruby_names = _script_names(directory, ".rb")
+    for name in sorted(python_names.intersection(_script_names(directory, ".js"))):
+        path = lambda extension: os.path.join(directory, name + extension)
+        has_lua = name in lua_names
+        items.append({
+            "name": name,
+            "python": path(".py"),
+            "js": path(".js"),
+            "lua": path(".lua") if has_lua else "",
+            "ruby": path(".rb") if has_lua and name in ruby_names else "",
+        })
+    return items
+
+
+def load_manifest(manifest:str) -> list:
+    base = os.path.dirname(os.path.abspath(manifest))
+    items = []
+    with open(manifest, "r") as manifest_file:
+        for number, line in enumerate(manifest_file, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+            else:
+                entry = dict(zip(BATCH_FIELDS, next(csv.reader([line]))))
+            item = {field: (entry.get(field) or "").strip() for field in BATCH_FIELDS}
+            for field in BATCH_FIELDS[1:]:
+                if item[field]:
+                    item[field] = os.path.join(base, item[field])
+            if not item["name"]:
+                item["name"] = os.path.splitext(os.path.basename(item["python"]))[0] or f"item{number}"
+            if entry.get("output"):
+                item["output"] = os.path.join(base, entry["output"])
+            if not item["python"] or not item["js"] or (item["ruby"] and not item["lua"]):
+                raise Exception(f"BATCH ERROR: Invalid program set on line {number} of {manifest}")
+            items.append(item)
+    return items
+
+
+def load_batch(source:str) -> list:
+    return load_directory(source) if os.path.isdir(source) else load_manifest(source)
+
+
+def run_batch(items, output_directory, zipper, template_for, jobs=1, log=None):
+    """
+    Zips every item with `zipper(python, js, lua, ruby, template)` using up to `jobs` threads. Writes each polyglot
+    to the output directory and a summary with per-item timings and failures. Returns the summary.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    log_lock = threading.Lock()
+
+    def zip_item(item):
+        output = item.get("output") or os.path.join(output_directory, item["name"] + OUTPUT_SUFFIX)
+        started = time.perf_counter()
+        report = {"name": item["name"], "output": output, "error": None}
+        try:
+            answer = zipper(item["python"], item["js"], item["lua"], item["ruby"],
+                            template_for(item["lua"], item["ruby"]))
+            with open(output, "w") as out_file:
+                out_file.write(answer)
+            emit("bytes", kind="output", count=len(answer.encode("utf-8", "surrogateescape")))
+        except Exception as e:
+            report["error"] = f"{type(e).__name__}: {e}"
+        report["seconds"] = round(time.perf_counter() - started, 6)
+        if log:
+            with log_lock:
+                log(f"{'FAILED' if report['error'] else 'OK'} {item['name']} ({report['seconds']:.3f}s)\n")
+        return report
+
+    started = time.perf_counter()
+    if jobs > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="batch") as executor:
+            reports = list(executor.map(zip_item, items))
+    else:
+        reports = [zip_item(item) for item in items]
+
+    summary = {
+        "total": len(reports),
+        "failures": sum(1 for report in reports if report["error"]),
+        "seconds": round(time.perf_counter() - started, 6),
+        "items": reports,
+    }
+    with open(os.path.join(output_directory, SUMMARY_FILE), "w") as summary_file:
+        json.dump(summary, summary_file, indent=2)
+    return summary
@@ -0,0 +1,284 @@
+import atexit
+import shutil
+import subprocess
+import threading
+
+from misc.stats import emit
+
+#
+# Warm checker workers
+#
+# Each worker is a long-lived interpreter that reads length-prefixed sources from stdin (`<bytes>\n<source>`) and
+# answers `1\n` (valid) or `0\n` (invalid) on stdout. This saves the interpreter start-up on every probe for those
+# languages that can't be checked in-process.
+#
+
+_NODE_WORKER = r"""
+const vm = require('vm');
+const esmHints = [
+  /Cannot use import statement outside a module/,
+  /Unexpected token 'export'/,
+  /Cannot use 'import\.meta' outside a module/,
+  /await is only valid in async functions/,
+  /Identifier '(?:require|module|exports|__filename|__dirname)' has already been declared/
+];
+function valid(src) {
+  src = src.replace(/^﻿/, '').replace(/^#!.*/, '');
+  try {
+    vm.compileFunction(src, ['exports', 'require', 'module', '__filename', '__dirname']);
+    return true;
+  } catch (e) {
+    if (!vm.SourceTextModule || !esmHints.some(h => h.test(e.message))) return false;
+  }
+  try { new vm.SourceTextModule(src); return true; } catch (e) { return false; }
+}
+let buffer = Buffer.alloc(0);
+process.stdin.on('data', chunk => {
+  buffer = Buffer.concat([buffer, chunk]);
+  for (;;) {
+    const nl = buffer.indexOf(10);
+    if (nl < 0) return;
+    const size = parseInt(buffer.subarray(0, nl).toString(), 10);
+    if (buffer.length < nl + 1 + size) return;
+    const src = buffer.subarray(nl + 1, nl + 1 + size).toString('utf8');
+    buffer = buffer.subarray(nl + 1 + size);
+    process.stdout.write(valid(src) ? '1\n' : '0\n');
+  }
+});
+"""
+
+_RUBY_WORKER = r"""
+$VERBOSE = nil
+$stdin.binmode
+$stdout.sync = true
+while (line = $stdin.gets)
+  src = line.to_i > 0 ? $stdin.read(line.to_i) : ""
+  src.force_encoding("UTF-8")
+  answer = begin
+    RubyVM::InstructionSequence.compile(src)
+    "1"
+  rescue SyntaxError, StandardError
+    "0"
+  end
+  $stdout.write(answer + "\n")
+end
+"""
+
+_LUA_WORKER = r"""
+local load = loadstring or load
+while true do
+  local line = io.read("*l")
+  if not line then break end
+  local size = tonumber(line) or 0
+  local src = size > 0 and io.read(size) or ""
+  if src:sub(1, 1) == "#" then src = src:gsub("^[^\n]*", "", 1) end
+  io.write(load(src, "=probe") and "1\n" or "0\n")
+  io.flush()
+end
+"""
+
+worker_commands = {
+    'javascript': ["node", "--experimental-vm-modules", "-e", _NODE_WORKER],
+    'ruby': ["ruby", "-e", _RUBY_WORKER],
+    'lua': ["lua", "-e", _LUA_WORKER]
+}
+
+pool_settings = {
+    'size': 1,
+}
+
+
+class WorkerError(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, command):
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def check(self, source:str) -> bool:
+        data = source.encode("utf-8", "surrogateescape")
+        emit("bytes", kind="probe_input", count=len(data))
+        try:
+            self.process.stdin.write(f"{len(data)}\n".encode() + data)
+            self.process.stdin.flush()
+            answer = self.process.stdout.readline()
+        except (BrokenPipeError, OSError, ValueError) as e:
+            raise WorkerError(str(e))
+        if answer not in (b"1\n", b"0\n"):
+            raise WorkerError(f"Unexpected worker answer ({answer!r})")
+        return answer == b"1\n"
+
+    def healthy(self) -> bool:
+        # An empty source is valid in every language, anything else means the worker is not answering properly
+        try:
+            return self.alive() and self.check("")
+        except WorkerError:
+            return False
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class CheckerPool:
+    def __init__(self, command, size):
+        self.command = command
+        self.size = max(1, size)
+        self._idle = []
+        self._spawned = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _spawn(self):
+        emit("subprocess", language=self.command[0], kind="worker")
+        worker = _Worker(self.command)
+        if not worker.healthy():
+            worker.close()
+            raise WorkerError(f"Worker failed to start ({self.command[0]})")
+        return worker
+
+    def _acquire(self):
+        # Waits for an idle worker or a free slot, a pool closed meanwhile (broken, resized) wakes every waiter up
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise WorkerError(f"Pool closed ({self.command[0]})")
+                if self._idle:
+                    return self._idle.pop()
+                if self._spawned < self.size:
+                    self._spawned += 1
+                    break
+                self._condition.wait()
+        try:
+            return self._spawn()
+        except (WorkerError, OSError):
+            with self._condition:
+                self._spawned -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, worker):
+        with self._condition:
+            if not self._closed:
+                self._idle.append(worker)
+                self._condition.notify()
+                return
+        self._discard(worker)
+
+    def _discard(self, worker):
+        worker.close()
+        with self._condition:
+            self._spawned -= 1
+            self._condition.notify()
+
+    def check(self, source:str) -> bool:
+        worker = self._acquire()
+        if not worker.alive():
+            self._discard(worker)
+            worker = self._acquire()
+        try:
+            answer = worker.check(source)
+        except WorkerError:
+            # Restart once on crash, a second failure is reported to the caller
+            self._discard(worker)
+            worker = self._acquire()
+            try:
+                answer = worker.check(source)
+            except WorkerError:
+                self._discard(worker)
+                raise
+        self._release(worker)
+        return answer
+
+    def health_check(self) -> int:
+        """Pings every idle worker, replacing the ones that don't answer. Returns the number of restarts."""
+        restarted = 0
+        with self._condition:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            if not worker.healthy():
+                # The replacement takes the slot over, nobody waiting can grab it meanwhile
+                worker.close()
+                restarted += 1
+                try:
+                    worker = self._spawn()
+                except (WorkerError, OSError):
+                    with self._condition:
+                        self._spawned -= 1
+                        self._condition.notify()
+                    continue
+            self._release(worker)
+        return restarted
+
+    def close(self):
+        """Closes the idle workers, the busy ones are closed as they come back. Waiting checks raise `WorkerError`."""
+        with self._condition:
+            self._closed = True
+            workers, self._idle = self._idle, []
+            self._condition.notify_all()
+        for worker in workers:
+            self._discard(worker)
+
+
+_pools = {}
+_broken = set()
+_pools_lock = threading.Lock()
+
+
+def set_pool_size(size:int) -> None:
+    """Sets the number of workers per language. A size of 0 disables the warm workers entirely."""
+    with _pools_lock:
+        pool_settings['size'] = size
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        _broken.clear()
+
+
+def get_pool(language:str):
+    """Returns the warm pool for a language, or None if the language has no worker or its interpreter is missing."""
+    if pool_settings['size'] <= 0 or language not in worker_commands or language in _broken:
+        return None
+    with _pools_lock:
+        if language not in _pools:
+            command = worker_commands[language]
+            if shutil.which(command[0]) is None:
+                _broken.add(language)
+                return None
+            _pools[language] = CheckerPool(command, pool_settings['size'])
+        return _pools[language]
+
+
+def health_check_pools() -> int:
+    """Pings the idle workers of every pool, replacing the ones that don't answer. Returns the number of restarts."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return sum(pool.health_check() for pool in pools)
+
+
+def mark_broken(language:str) -> None:
+    with _pools_lock:
+        _broken.add(language)
+        pool = _pools.pop(language, None)
+    if pool:
+        pool.close()
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,85 @@
+import re
+
+#
+# Escaping engine
+#
+# Rewrites every forbidden token of a source in a single scan, instead of one full `.replace` pass per token. Tokens
+# are matched leftmost-longest without overlapping, which is what chained `.replace` calls do as long as no token
+# overlaps another one or shows up in a replacement (true for every token below).
+#
+
+# Hex escapes that are valid inside the strings of every language
+ESCAPES = {
+    "*/": "\\x2A/",
+    "]===]": "]=\\x3D=]",
+    '"""': "\\x22\\x22\\x22",
+}
+
+_patterns = {}
+
+
+def token_pattern(tokens) -> re.Pattern:
+    key = frozenset(tokens)
+    if key not in _patterns:
+        ordered = [re.escape(t) for t in sorted(key, key=len, reverse=True)]
+        # Bytes tokens give a pattern for bytes-like data
+        _patterns[key] = re.compile((b"|" if isinstance(ordered[0], bytes) else "|").join(ordered))
+    return _patterns[key]
+
+
+def find_tokens(text:str, tokens) -> list:
+    """Returns the (offset, token) of every occurrence, in a single scan."""
+    if not tokens:
+        return []
+    return [(m.start(), m.group()) for m in token_pattern(tokens).finditer(text)]
+
+
+def escape_tokens(text:str, replacements:dict) -> str:
+    """Replaces every token in `replacements` with its replacement, in a single scan and a single join."""
+    occurrences = find_tokens(text, replacements)
+    if not occurrences:
+        return text
+    pieces = []
+    position = 0
+    for offset, token in occurrences:
+        pieces.append(text[position:offset])
+        pieces.append(replacements[token])
+        position = offset + len(token)
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+
+def iter_escaped(data, replacements:dict, chunk_size:int=1 << 20):
+    """
+    escape_tokens for bytes-like data (a memory-mapped file included) that yields the result in chunks of about
+    `chunk_size` bytes instead of building it.
+    """
+    encoded = {token.encode(): replacement.encode() for token, replacement in replacements.items()}
+    matches = token_pattern(encoded).finditer(data) if encoded else ()
+    buffer = bytearray()
+    position = 0
+    # Chunks are copies, views into `data` would keep a mapped file from being closed (and die with it)
+    with memoryview(data) as view:
+        for match in matches:
+            buffer += view[position:match.start()]
+            buffer += encoded[match.group()]
+            position = match.end()
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        yield bytes(buffer)
+        for start in range(position, len(data), chunk_size):
+            yield bytes(view[start:min(start + chunk_size, len(data))])
+
+
+def blanket_escapes(tokens) -> dict:
+    """The hex escapes for those tokens that are always replaced, regardless of where they are."""
+    return {token: ESCAPES[token] for token in tokens if token in ESCAPES}
+
+
+def unique_suffix(text:str, replacement:str) -> str:
+    """Appends the fewest `x` needed for `replacement` not to appear in `text`."""
+    longest = -1
+    for match in re.finditer(f"(?={re.escape(replacement)}(x*))", text):
+        longest = max(longest, len(match.group(1)))
+    return replacement + "x" * (longest + 1)
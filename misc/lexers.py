@@ -0,0 +1,598 @@
+import bisect
+import io
+import tokenize
+
+#
+# Lightweight lexers
+#
+# Instead of mutating the file and asking a compiler, these lexers find every literal and comment in a single pass and
+# classify each token occurrence by the region it sits in:
+#
+#   * "code"       Outside any literal or comment.
+#   * "comment"    Inside a comment (or Ruby's `__END__` data).
+#   * "string"     Inside an escaping string (Ruby double quotes, backticks, %Q...).
+#   * "sq_string"  Inside a Ruby single-quoted string.
+#   * "raw"        Inside a non-escaping literal (Lua long strings, Ruby %q/%w/%i...).
+#   * "regex"      Inside a regular expression.
+#   * "heredoc"    Inside a Ruby heredoc.
+#   * None         Ambiguous, only a compiler can tell (template literals, interpolation, regex-vs-division...).
+#
+# Once a lexer is not sure about the state it is in, everything after that point is ambiguous.
+#
+
+def _region(start, end, inner_start, inner_end, kind):
+    return start, end, inner_start, inner_end, kind
+
+def _bail(regions, start, end):
+    regions.append(_region(start, end, start, end, None))
+    return end
+
+def _eol(body, i):
+    end = body.find("\n", i)
+    return len(body) if end < 0 else end
+
+def _at_line_start(body, i):
+    return i == 0 or body[i - 1] == "\n"
+
+def _is_word(c):
+    return c.isalnum() or c == "_" or ord(c) > 127
+
+
+#
+# JavaScript
+#
+
+_JS_REGEX_KEYWORDS = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do",
+                      "else", "yield", "await"}
+_JS_CONTROL_KEYWORDS = {"if", "while", "for", "with"}
+
+def _scan_js_quoted(body, i, quote):
+    j = i + 1
+    while j < len(body):
+        c = body[j]
+        if c == "\\":
+            j += 2
+        elif c == quote:
+            return j + 1
+        elif c == "\n":
+            return -1
+        else:
+            j += 1
+    return -1
+
+def _scan_js_template(body, i):
+    j = i + 1
+    while j < len(body):
+        c = body[j]
+        if c == "\\":
+            j += 2
+        elif c == "`":
+            return j + 1
+        elif body.startswith("${", j):
+            j = _scan_js(body, j + 2, [], nested=True)
+            if j < 0:
+                return -1
+        else:
+            j += 1
+    return -1
+
+def _scan_js_regex(body, i):
+    j = i + 1
+    in_class = False
+    while j < len(body):
+        c = body[j]
+        if c == "\\":
+            j += 2
+        elif c == "\n":
+            return -1, -1
+        elif c == "[":
+            in_class = True
+            j += 1
+        elif c == "]":
+            in_class = False
+            j += 1
+        elif c == "/" and not in_class:
+            close = j
+            j += 1
+            while j < len(body) and _is_word(body[j]):
+                j += 1
+            return close, j
+        else:
+            j += 1
+    return -1, -1
+
+def _scan_js(body, i, regions, nested=False):
+    """Scans JS code from `i`. When nested (inside `${}`), returns right after the closing brace, or -1."""
+    n = len(body)
+    prev = None
+    word = ""
+    depth = 0
+    parens = []
+    if not nested and body.startswith("#!"):
+        end = _eol(body, 0)
+        regions.append(_region(0, end, 2, end, "comment"))
+        i = end
+    while i < n:
+        c = body[i]
+        if c.isspace():
+            i += 1
+            continue
+        if body.startswith("//", i):
+            end = _eol(body, i)
+            regions.append(_region(i, end, i + 2, end, "comment"))
+            i = end
+            continue
+        if body.startswith("/*", i):
+            end = body.find("*/", i + 2)
+            if end < 0:
+                return -1 if nested else _bail(regions, i, n)
+            regions.append(_region(i, end + 2, i + 2, end, "comment"))
+            i = end + 2
+            continue
+        if c in "'\"":
+            end = _scan_js_quoted(body, i, c)
+            if end < 0:
+                return -1 if nested else _bail(regions, i, n)
+            regions.append(_region(i, end, i + 1, end - 1, "string"))
+            prev, i = "value", end
+        elif c == "`":
+            end = _scan_js_template(body, i)
+            if end < 0:
+                return -1 if nested else _bail(regions, i, n)
+            regions.append(_region(i, end, i, end, None))
+            prev, i = "value", end
+        elif c == "/":
+            if prev == "}":
+                return -1 if nested else _bail(regions, i, n)
+            if prev == "value":
+                prev, i = "op", i + 1
+                continue
+            close, end = _scan_js_regex(body, i)
+            if end < 0:
+                return -1 if nested else _bail(regions, i, n)
+            regions.append(_region(i, end, i + 1, close, "regex"))
+            prev, i = "value", end
+        elif _is_word(c) or c == "$":
+            j = i + 1
+            while j < n and (_is_word(body[j]) or body[j] == "$"):
+                j += 1
+            word = body[i:j]
+            prev = "keyword" if word in _JS_REGEX_KEYWORDS else "value"
+            i = j
+            continue
+        elif c in "+-" and body.startswith(c * 2, i):
+            # Postfix increments keep the previous value, prefix ones are just operators
+            prev = "value" if prev == "value" else "op"
+            i += 2
+        elif c == "{":
+            depth += 1
+            prev, i = "op", i + 1
+        elif c == "}":
+            if nested and depth == 0:
+                return i + 1
+            depth -= 1
+            prev, i = "}", i + 1
+        elif c == "(":
+            parens.append(prev == "value" and word in _JS_CONTROL_KEYWORDS)
+            prev, i = "op", i + 1
+        elif c == ")":
+            # A regex may follow `if (...)`, a division follows any other parenthesized value
+            prev = "op" if parens and parens.pop() else "value"
+            i += 1
+        elif c == "]":
+            prev, i = "value", i + 1
+        else:
+            prev, i = "op", i + 1
+        word = ""
+    return -1 if nested else n
+
+
+#
+# Lua
+#
+
+def _lua_long_bracket(body, i):
+    """Returns the level of a long bracket opening at `i` (`[==[` is 2), or -1."""
+    j = i + 1
+    while j < len(body) and body[j] == "=":
+        j += 1
+    return j - i - 1 if j < len(body) and body[i] == "[" and body[j] == "[" else -1
+
+def _scan_lua(body, regions):
+    n = len(body)
+    i = 0
+    if body.startswith("#"):
+        i = _eol(body, 0)
+        regions.append(_region(0, i, 1, i, "comment"))
+    while i < n:
+        c = body[i]
+        if body.startswith("--", i):
+            level = _lua_long_bracket(body, i + 2) if body.startswith("[", i + 2) else -1
+            if level >= 0:
+                opener = i + 2 + level + 2
+                end = body.find("]" + "=" * level + "]", opener)
+                if end < 0:
+                    return _bail(regions, i, n)
+                regions.append(_region(i, end + level + 2, opener, end, "comment"))
+                i = end + level + 2
+            else:
+                end = _eol(body, i)
+                regions.append(_region(i, end, i + 2, end, "comment"))
+                i = end
+        elif c == "[" and (level := _lua_long_bracket(body, i)) >= 0:
+            opener = i + level + 2
+            end = body.find("]" + "=" * level + "]", opener)
+            if end < 0:
+                return _bail(regions, i, n)
+            regions.append(_region(i, end + level + 2, opener, end, "raw"))
+            i = end + level + 2
+        elif c in "'\"":
+            j = i + 1
+            while j < n and body[j] != c:
+                if body[j] == "\n":
+                    return _bail(regions, i, n)
+                j += 2 if body[j] == "\\" else 1
+            if j >= n:
+                return _bail(regions, i, n)
+            regions.append(_region(i, j + 1, i + 1, j, "string"))
+            i = j + 1
+        else:
+            i += 1
+    return n
+
+
+#
+# Ruby
+#
+
+_RUBY_VALUE_KEYWORDS = {"end", "self", "nil", "true", "false", "__FILE__", "__LINE__", "__method__"}
+_RUBY_OPERATOR_KEYWORDS = {"if", "unless", "while", "until", "and", "or", "not", "return", "when", "in", "then", "do",
+                           "else", "elsif", "begin", "case", "yield"}
+_RUBY_PAIRS = {"(": ")", "[": "]", "{": "}", "<": ">"}
+
+def _scan_ruby_delimited(body, i, opener, closer, interpolates):
+    """Scans a literal whose content starts at `i`. Returns (close, end, interpolated) or (-1, -1, False)."""
+    j = i
+    depth = 0
+    interpolated = False
+    while j < len(body):
+        c = body[j]
+        if c == "\\":
+            j += 2
+        elif interpolates and body.startswith("#{", j):
+            interpolated = True
+            j = _scan_ruby(body, j + 2, [], nested=True)
+            if j < 0:
+                return -1, -1, False
+        elif interpolates and c == "#" and j + 1 < len(body) and body[j + 1] in "@$":
+            interpolated = True
+            j += 1
+        elif c == closer and depth == 0:
+            return j, j + 1, interpolated
+        elif c == closer:
+            depth -= 1
+            j += 1
+        elif c == opener and opener != closer:
+            depth += 1
+            j += 1
+        else:
+            j += 1
+    return -1, -1, False
+
+def _scan_ruby_heredocs(body, i, pending, regions):
+    """Consumes the bodies of the pending heredocs, starting at line `i`. Returns where the code resumes, or -1."""
+    for terminator, indented, interpolates in pending:
+        start = i
+        while True:
+            if i >= len(body):
+                return -1
+            end = _eol(body, i)
+            line = body[i:end].rstrip("\r")
+            if (line.strip() if indented else line) == terminator:
+                kind = "heredoc" if not (interpolates and "#{" in body[start:i]) else None
+                regions.append(_region(start, end, start, i, kind))
+                i = end + 1
+                break
+            i = end + 1
+    pending.clear()
+    return min(i, len(body))
+
+def _scan_ruby(body, i, regions, nested=False):
+    """Scans Ruby code from `i`. When nested (inside `#{}`), returns right after the closing brace, or -1."""
+    n = len(body)
+    prev = None
+    spaced = False
+    depth = 0
+    pending = []
+    fail = (lambda at: -1) if nested else (lambda at: _bail(regions, at, n))
+
+    while i < n:
+        c = body[i]
+        if c == "\n" and pending:
+            i = _scan_ruby_heredocs(body, i + 1, pending, regions)
+            if i < 0:
+                return fail(n)
+            prev, spaced = None, True
+            continue
+        if c.isspace():
+            if c == "\n" and prev != "op":
+                prev = None
+            spaced = True
+            i += 1
+            continue
+        was_spaced, spaced = spaced, False
+        if c == "#":
+            end = _eol(body, i)
+            regions.append(_region(i, end, i + 1, end, "comment"))
+            i = end
+        elif c == "=" and _at_line_start(body, i) and body.startswith("=begin", i):
+            end = body.find("\n=end", i)
+            if end < 0:
+                return fail(i)
+            end = _eol(body, end + 1)
+            regions.append(_region(i, end, i + 6, end, "comment"))
+            i = end
+        elif c == "_" and _at_line_start(body, i) and body[i:_eol(body, i)].rstrip("\r") == "__END__":
+            regions.append(_region(i, n, i + 7, n, "comment"))
+            return n if not nested else -1
+        elif c in "'\"`":
+            close, end, interpolated = _scan_ruby_delimited(body, i + 1, c, c, c != "'")
+            if end < 0:
+                return fail(i)
+            kind = "sq_string" if c == "'" else "string"
+            regions.append(_region(i, end, i + 1, close, None if interpolated else kind))
+            prev, i = "value", end
+        elif c == ":" and i + 1 < n and body[i + 1] in "'\"":
+            close, end, interpolated = _scan_ruby_delimited(body, i + 2, body[i + 1], body[i + 1], body[i + 1] == '"')
+            if end < 0:
+                return fail(i)
+            kind = "sq_string" if body[i + 1] == "'" else "string"
+            regions.append(_region(i, end, i + 2, close, None if interpolated else kind))
+            prev, i = "value", end
+        elif c in "/%?" or body.startswith("<<", i):
+            # Literal or operator? Values before it mean an operator, unless they look like a method call argument
+            after = i + (2 if c == "<" else 1)
+            ambiguous = prev == "ident" and was_spaced and after < n and not body[after].isspace() \
+                        and body[after] != "="
+            if ambiguous:
+                return fail(i)
+            if prev in ("value", "ident", "}"):
+                prev, i = "op", after
+                continue
+            if c == "?":
+                j = i + 3 if body.startswith("\\", i + 1) else i + 2
+                if i + 1 < n and j <= n and not body[i + 1].isspace() and (j == n or not _is_word(body[j])):
+                    regions.append(_region(i, j, i + 1, j, "raw"))
+                    prev, i = "value", j
+                else:
+                    prev, i = "op", i + 1
+            elif c == "/":
+                close, end, interpolated = _scan_ruby_delimited(body, i + 1, "/", "/", True)
+                if end < 0:
+                    return fail(i)
+                while end < n and body[end].isalpha():
+                    end += 1
+                regions.append(_region(i, end, i + 1, close, None if interpolated else "regex"))
+                prev, i = "value", end
+            elif c == "%":
+                j = i + 1
+                flavour = body[j] if j < n and body[j] in "qQwWiIrsx" else ""
+                j += len(flavour)
+                if j >= n or _is_word(body[j]) or body[j].isspace():
+                    prev, i = "op", i + 1
+                    continue
+                opener = body[j]
+                close, end, interpolated = _scan_ruby_delimited(
+                    body, j + 1, opener, _RUBY_PAIRS.get(opener, opener), flavour in ("", "Q", "W", "I", "r", "x"))
+                if end < 0:
+                    return fail(i)
+                if flavour == "r":
+                    while end < n and body[end].isalpha():
+                        end += 1
+                kind = "regex" if flavour == "r" else ("raw" if flavour in "qwis" and flavour else "string")
+                regions.append(_region(i, end, j + 1, close, None if interpolated else kind))
+                prev, i = "value", end
+            else:
+                j = i + 2
+                indented = j < n and body[j] in "-~"
+                j += indented
+                quote = body[j] if j < n and body[j] in "'\"`" else ""
+                j += len(quote)
+                k = j
+                while k < n and _is_word(body[k]):
+                    k += 1
+                if k == j or (quote and not body.startswith(quote, k)):
+                    prev, i = "op", i + 2
+                    continue
+                pending.append((body[j:k], indented, quote != "'"))
+                prev, i = "value", k + len(quote)
+        elif c == "$":
+            j = i + 1
+            if j < n and _is_word(body[j]):
+                while j < n and _is_word(body[j]):
+                    j += 1
+            else:
+                j += 1
+            prev, i = "value", j
+        elif _is_word(c) or c == "@":
+            j = i + 1
+            while j < n and (_is_word(body[j]) or body[j] == "@"):
+                j += 1
+            if j < n and body[j] in "?!" and not body.startswith("=", j + 1):
+                j += 1
+            word = body[i:j]
+            if word[0].isdigit() or word[0].isupper() or word[0] == "@" or word in _RUBY_VALUE_KEYWORDS:
+                prev = "value"
+            elif word in _RUBY_OPERATOR_KEYWORDS:
+                prev = "op"
+            else:
+                # Either a local variable or a method call, only the former makes `x /y/` a division
+                prev = "ident"
+            i = j
+        elif c == "{":
+            depth += 1
+            prev, i = "op", i + 1
+        elif c == "}":
+            if nested and depth == 0:
+                return i + 1
+            depth -= 1
+            prev, i = "}", i + 1
+        elif c in ")]":
+            prev, i = "value", i + 1
+        else:
+            prev, i = "op", i + 1
+
+    if pending:
+        return fail(n)
+    return -1 if nested else n
+
+
+#
+# Python
+#
+
+def _scan_python(body, regions):
+    lines = io.StringIO(body).readlines()
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    at = lambda pos: offsets[pos[0] - 1] + pos[1]
+
+    fstring_start = None
+    try:
+        for tok in tokenize.generate_tokens(io.StringIO(body).readline):
+            if tok.type == tokenize.ERRORTOKEN and not tok.string.isspace():
+                return _bail(regions, at(tok.start), len(body))
+            if tok.type == tokenize.COMMENT:
+                regions.append(_region(at(tok.start), at(tok.end), at(tok.start) + 1, at(tok.end), "comment"))
+            elif tok.type == tokenize.STRING:
+                start, end = at(tok.start), at(tok.end)
+                prefix = len(tok.string) - len(tok.string.lstrip("rRbBuUfF"))
+                quote = 3 if tok.string[prefix:prefix + 3] in ('"""', "'''") else 1
+                kind = None if "f" in tok.string[:prefix].lower() else "string"
+                regions.append(_region(start, end, start + prefix + quote, end - quote, kind))
+            elif tok.type == getattr(tokenize, "FSTRING_START", None) and fstring_start is None:
+                fstring_start = at(tok.start)
+            elif tok.type == getattr(tokenize, "FSTRING_END", None):
+                if fstring_start is not None and at(tok.end) > fstring_start:
+                    nested_start = fstring_start
+                    fstring_start = None
+                    regions.append(_region(nested_start, at(tok.end), nested_start, at(tok.end), None))
+    except (tokenize.TokenError, SyntaxError):
+        return _bail(regions, 0, len(body))
+    return len(body)
+
+
+def find_regions(body:str, language:str) -> list:
+    """Returns the sorted (start, end, inner_start, inner_end, kind) literal and comment regions of a source."""
+    regions = []
+    if language == "py":
+        _scan_python(body, regions)
+    elif language == "javascript":
+        _scan_js(body, 0, regions)
+    elif language == "lua":
+        _scan_lua(body, regions)
+    elif language == "ruby":
+        _scan_ruby(body, 0, regions)
+    else:
+        return [_region(0, len(body), 0, len(body), None)]
+
+    # Nested scans and heredocs may append out of order, the outermost region wins
+    regions.sort(key=lambda r: (r[0], -r[1]))
+    merged = []
+    for region in regions:
+        if merged and region[0] < merged[-1][1]:
+            continue
+        merged.append(region)
+    return merged
+
+
+def find_occurrences(body:str, token:str) -> list:
+    """Offsets of the occurrences of `token`, matching the pieces of `body.split(token)`."""
+    found = []
+    position = body.find(token)
+    while position >= 0:
+        found.append(position)
+        position = body.find(token, position + len(token))
+    return found
+
+
+def classify_occurrences(body:str, language:str, token:str, regions=None) -> list:
+    """Returns the region kind of every occurrence of `token` in `body` (see the header of this file)."""
+    if regions is None:
+        regions = find_regions(body, language)
+    starts = [r[0] for r in regions]
+    kinds = []
+    for position in find_occurrences(body, token):
+        end = position + len(token)
+        index = bisect.bisect_right(starts, position) - 1
+        if position > 0 and body[position - 1] == "\\":
+            kinds.append(None)
+        elif index >= 0 and position < regions[index][1]:
+            _, _, inner_start, inner_end, kind = regions[index]
+            kinds.append(kind if inner_start <= position and end <= inner_end else None)
+        elif index + 1 < len(regions) and regions[index + 1][0] < end:
+            kinds.append(None)
+        else:
+            kinds.append("code")
+    return kinds
+
+
+#
+# Top-level cuts
+#
+# Offsets of the lines that start a new top-level statement: outside any literal, at bracket depth 0, not indented and
+# not continuing the previous statement. Any slice between two cuts is a candidate to be compiled on its own. Lines
+# that start or end right at a literal (a heredoc body and its terminator) are never cut, nor anything past a region
+# the lexers gave up on.
+#
+
+_CONTINUATION_WORDS = {
+    "py": {"else", "elif", "except", "finally", "case"},
+    "javascript": {"else", "catch", "finally"},
+    "lua": {"end", "else", "elseif", "until"},
+    "ruby": {"end", "else", "elsif", "rescue", "ensure", "when", "in", "then", "do"},
+}
+# Brackets and template literals continue the previous line in JS (and call it in Lua)
+_CONTINUATION_CHARS = ".?:)]},+-*/%&|^=<>\\([`"
+_HANGING_CHARS = ".?:,+-*/%&|^=<>\\([{"
+
+def _starts_statement(body, i, language):
+    if i >= len(body) or body[i].isspace() or body[i] in _CONTINUATION_CHARS:
+        return False
+    j = i
+    while j < len(body) and _is_word(body[j]):
+        j += 1
+    if body[i:j] in _CONTINUATION_WORDS.get(language, ()):
+        return False
+    previous = body.rfind("\n", 0, i - 1) + 1
+    # Decorators, explicit line continuations and lines left hanging on an operator belong to the following line
+    return not (body[previous:i].rstrip().endswith(tuple(_HANGING_CHARS)) or
+                (language == "py" and body.startswith("@", previous)))
+
+def find_top_level_cuts(body:str, language:str, regions=None) -> list:
+    if regions is None:
+        regions = find_regions(body, language)
+    cuts = [0]
+    depth = 0
+    position = 0
+    # Whether the last region spans lines (the statement it belongs to may go on right after it)
+    spanning = False
+    for start, end, _, _, kind in regions + [_region(len(body), len(body), len(body), len(body), "code")]:
+        for i in range(position, start):
+            c = body[i]
+            if c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth = max(0, depth - 1)
+            elif c == "\n" and depth == 0 and not (i + 1 == start and kind in ("heredoc", None)) and \
+                    not (spanning and i == position) and \
+                    _starts_statement(body, i + 1, language):
+                cuts.append(i + 1)
+        if kind is None:
+            break
+        if end > position:
+            position = end
+            spanning = kind == "heredoc" or "\n" in body[start:end]
+    cuts.append(len(body))
+    return cuts
@@ -0,0 +1,202 @@
+import bisect
+import re
+
+from misc.escaping import find_tokens
+from misc.lexers import classify_occurrences, find_occurrences, find_regions
+from misc.plan import escape_plan
+from misc.stats import emit, phase
+from misc.syntax_checker import check_syntax
+from misc.verify import CHECKER_LANGUAGES
+
+#
+# Output minimizer
+#
+# Shrinks every section once it has been escaped, in three steps: removing comments, removing blank lines and
+# swapping the hex escapes for the shortest equivalent ones. Only what the lexer is sure about is touched (comments it
+# found, blank lines outside every literal, escapes inside plain escaping strings), and a step is kept only if the
+# section still compiles afterwards and no forbidden token showed up.
+#
+
+# Stage name of the minimizing decisions in an escape plan, one verdict per step
+MINIMIZE_STAGE = "<minimize>"
+
+minimizer_settings = {
+    'enabled': False,
+}
+
+# Shortest escapes meaning the same as the hex ones inside escaping strings. Sections sit inside the hiding blocks of
+# the other languages (Python strings among them), so only escapes valid there too are used: `\\=` and `\\/` are not.
+SHORT_ESCAPES = {
+    'python': {"\\x2A/": "\\52/", "]=\\x3D=]": "]=\\75=]"},
+    'javascript': {"\\x22\\x22\\x22": '""\\"'},
+    'lua': {"\\x22\\x22\\x22": '""\\"', "\\x2A/": "\\42/"},
+    'ruby': {"\\x22\\x22\\x22": '""\\"'},
+}
+
+# Comments that mean something to the interpreter (or to the people shipping the file)
+_KEPT_COMMENTS = re.compile(r"#!|#.*coding[:=]|#\s*(frozen_string_literal|warn_indent|shareable_constant_value):|"
+                            r"//[#@]|/\*[!@]|--\[=*\[!")
+
+
+def set_minimize(enabled:bool) -> None:
+    minimizer_settings['enabled'] = enabled
+
+
+def _removable_comment(body, start, end, language):
+    text = body[start:end]
+    if _KEPT_COMMENTS.match(text):
+        return False
+    if language == "ruby":
+        # `=begin` blocks and `__END__` data are comments to the lexer, only `#` ones can go
+        return text.startswith("#")
+    return True
+
+
+def remove_comments(body:str, language:str) -> str:
+    pieces = []
+    position = 0
+    for start, end, _, _, kind in find_regions(body, CHECKER_LANGUAGES[language]):
+        if kind != "comment" or not _removable_comment(body, start, end, language):
+            continue
+        code = body[position:start]
+        if "\n" not in body[start:end]:
+            # A line comment goes with the blanks before it, the line break stays
+            pieces.append(code.rstrip(" \t") if code.rstrip(" \t").endswith("\n") or body[end:end + 1] in ("\n", "")
+                          else code + " ")
+        else:
+            pieces.append(code + "\n")
+        position = end
+    pieces.append(body[position:])
+    return ''.join(pieces)
+
+
+def remove_blank_lines(body:str, language:str) -> str:
+    regions = find_regions(body, CHECKER_LANGUAGES[language])
+    inside = [(start, end) for start, end, _, _, _ in regions]
+    lines = body.splitlines(keepends=True)
+    kept = []
+    offset = 0
+    index = 0
+    for line in lines:
+        end = offset + len(line)
+        while index < len(inside) and inside[index][1] <= offset:
+            index += 1
+        in_literal = index < len(inside) and inside[index][0] < end
+        if in_literal or line.strip(" \t\r\n") or not line.endswith("\n"):
+            kept.append(line)
+        offset = end
+    return ''.join(kept)
+
+
+def shorten_escapes(body:str, language:str, forbidden) -> str:
+    escapes = SHORT_ESCAPES.get(language, {})
+    if not escapes:
+        return body
+    lexer_language = CHECKER_LANGUAGES[language]
+    regions = find_regions(body, lexer_language)
+    longest = max((len(token) for token in forbidden), default=1)
+    occurrences = sorted(
+        (offset, escape)
+        for escape in escapes
+        for offset, kind in zip(find_occurrences(body, escape),
+                                classify_occurrences(body, lexer_language, escape, regions))
+        if kind == "string" and not _raw_python_string(body, offset, regions, language))
+    starts = [start for start, _, _, _, _ in regions]
+
+    pieces = []
+    position = 0
+    for offset, escape in occurrences:
+        if offset < position:
+            continue
+        pieces.append(body[position:offset])
+        shorter = _inside_literal(escapes[escape], body, regions[bisect.bisect_right(starts, offset) - 1])
+        # The shorter escape must not make a forbidden token with what surrounds it
+        left = ''.join(pieces)[-(longest - 1):] if longest > 1 else ""
+        right = body[offset + len(escape):offset + len(escape) + longest - 1]
+        pieces.append(escape if find_tokens(left + shorter + right, forbidden) else shorter)
+        position = offset + len(escape)
+    pieces.append(body[position:])
+    return ''.join(pieces)
+
+
+def _inside_literal(shorter, body, region):
+    # `""\"` would close a `"` string (Ruby then glues the literals around it together), its delimiter gets escaped
+    _, end, _, inner_end, _ = region
+    closing = body[inner_end:end]
+    if len(closing) != 1 or closing not in shorter:
+        return shorter
+    return shorter.replace("\\" + closing, closing).replace(closing, "\\" + closing)
+
+
+def _raw_python_string(body, offset, regions, language):
+    # The Python lexer doesn't tell raw strings apart, their prefix does
+    if language != "python":
+        return False
+    for start, end, inner_start, _, _ in regions:
+        if start <= offset < end:
+            return "r" in body[start:inner_start].lower()
+    return False
+
+
+def minimize_section(body:str, language:str, forbidden, compiles=None) -> str:
+    """
+    Runs every minimizing step that keeps the `language` (python, javascript, lua or ruby) section `body` compiling and
+    free of forbidden tokens, reporting the savings. `compiles(candidate)` tells whether a minimized section still
+    compiles, by default with its own checker.
+    """
+    if compiles is None:
+        compiles = lambda code: check_syntax(CHECKER_LANGUAGES[language], source=code)
+    tokens = len(find_tokens(body, forbidden))
+    steps = [
+        lambda code: remove_comments(code, language),
+        lambda code: remove_blank_lines(code, language),
+        lambda code: shorten_escapes(code, language, forbidden),
+    ]
+    # Which steps were kept goes into the escape plan, a replay takes the same ones without compiling anything
+    plan = escape_plan.get()
+    if plan is not None:
+        stage = plan.stage(language, MINIMIZE_STAGE, "")
+        if plan.replaying and stage not in plan.stages:
+            raise Exception(f"PLAN ERROR: The plan holds no minimizing decisions for {language} (zipped without "
+                            f"minimizing?)")
+    replayed = plan.verdicts(stage, len(steps)) if plan is not None and plan.replaying else None
+
+    minimized = body
+    kept = []
+    for n, step in enumerate(steps):
+        candidate = step(minimized)
+        if replayed is not None:
+            valid = replayed[n]
+        elif candidate == minimized or len(find_tokens(candidate, forbidden)) > tokens:
+            valid = False
+        else:
+            try:
+                valid = compiles(candidate)
+            except OSError:
+                valid = False
+        if valid:
+            minimized = candidate
+        kept.append(valid)
+    if plan is not None and not plan.replaying:
+        plan.record(stage, kept)
+
+    saved = len(body.encode("utf-8", "surrogateescape")) - len(minimized.encode("utf-8", "surrogateescape"))
+    emit("bytes", kind="minimize_saved", count=saved)
+    emit("bytes", kind=f"minimize_saved[{language}]", count=saved)
+    return minimized
+
+
+def minimize_sections(codes, template) -> list:
+    """
+    Minimizes the escaped sections of a template, in order. A step is kept only if the assembled polyglot still
+    compiles with the checker of every language in the template: a section is also read by the others.
+    """
+    codes = list(codes)
+    for n, language in enumerate(template.profile):
+        def compiles(candidate, n=n):
+            polyglot = ''.join(template.fill(m, candidate if m == n else code) for m, code in enumerate(codes))
+            return all(check_syntax(CHECKER_LANGUAGES[other], source=polyglot) for other in template.profile)
+
+        with phase("minimize", language):
+            codes[n] = minimize_section(codes[n], language, template.forbidden[language], compiles)
+    return codes
@@ -0,0 +1,87 @@
+import contextlib
+import contextvars
+import hashlib
+import json
+import threading
+
+#
+# Escape plans
+#
+# A plan holds every decision a zip took: for each probing stage (language, token, breaker, and the order of the stage
+# among the same ones) whether each occurrence got the negative (`n`) or the positive (`p`) replacement, along with
+# the SHA-256 of every source. With `--minimize`, each section also gets a `<minimize>` stage telling which minimizing
+# steps were kept. Replaying a plan rewrites the same sources the same way without a single probe, so no checker needs
+# to be installed. A source that doesn't match its hash stops the zip before anything is rewritten.
+#
+
+PLAN_VERSION = 1
+
+# The plan of the zip running in the current context, see `using_plan`
+escape_plan = contextvars.ContextVar("escape_plan", default=None)
+
+
+class EscapePlan:
+    def __init__(self, data=None):
+        self.replaying = data is not None
+        data = data or {"version": PLAN_VERSION, "sources": {}, "stages": []}
+        if data.get("version") != PLAN_VERSION:
+            raise Exception(f"PLAN ERROR: Unsupported plan version ({data.get('version')})")
+        self.sources = dict(data["sources"])
+        self.stages = {(s["language"], s["token"], s["breaker"], s["index"]): s["verdicts"] for s in data["stages"]}
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def source(self, language, code):
+        """`code` is the source text, or its UTF-8 bytes."""
+        digest = hashlib.sha256(code.encode("utf-8", "surrogateescape") if isinstance(code, str) else code).hexdigest()
+        with self._lock:
+            if not self.replaying:
+                self.sources[language] = digest
+            elif self.sources.get(language) != digest:
+                raise Exception(f"PLAN ERROR: The {language} source doesn't match the plan "
+                                f"(sha256 {digest}, expected {self.sources.get(language)})")
+
+    def stage(self, language, token, breaker):
+        # Same as the watch mode, a stage that runs more than once per zip is told apart by its order
+        with self._lock:
+            key = (language, token, breaker)
+            index = self._seen.get(key, 0)
+            self._seen[key] = index + 1
+            return key + (index,)
+
+    def verdicts(self, stage, count) -> list:
+        verdicts = self.stages.get(stage)
+        if verdicts is None or len(verdicts) != count:
+            raise Exception(f"PLAN ERROR: No decisions for {count} occurrences of `{stage[1]}` in {stage[0]} "
+                            f"(breaker `{stage[2]}`, stage {stage[3]})")
+        return [verdict == "n" for verdict in verdicts]
+
+    def record(self, stage, verdicts):
+        with self._lock:
+            self.stages[stage] = ''.join("n" if verdict else "p" for verdict in verdicts)
+
+    def to_json(self) -> str:
+        stages = [{"language": language, "token": token, "breaker": breaker, "index": index, "verdicts": verdicts}
+                  for (language, token, breaker, index), verdicts in sorted(self.stages.items())]
+        return json.dumps({"version": PLAN_VERSION, "sources": self.sources, "stages": stages}, indent=2)
+
+
+def load_plan(path) -> EscapePlan:
+    with open(path, "r") as plan_file:
+        return EscapePlan(json.load(plan_file))
+
+
+def plan_source(language, code) -> None:
+    """Records (or checks, when replaying) the hash of a section's source, if a plan is in use."""
+    if (plan := escape_plan.get()) is not None:
+        plan.source(language, code)
+
+
+@contextlib.contextmanager
+def using_plan(plan):
+    """Zips started inside record their decisions into the plan, or replay them if it was loaded."""
+    token = escape_plan.set(plan)
+    try:
+        yield plan
+    finally:
+        escape_plan.reset(token)
@@ -0,0 +1,108 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+
+#
+# Probe verdict cache
+#
+# Stores the result of every syntax check, keyed by a hash of (language, checker version, probed text), so re-zipping
+# unchanged sources doesn't need to ask the checkers again. Entries are evicted least-recently-used first once the
+# cache grows past `max_entries`. Every write is committed right away (the journal is a WAL), so processes sharing
+# the cache directory never wait on each other for longer than a single write.
+#
+
+CACHE_FILE = "probe_cache.sqlite3"
+CACHE_FORMAT = 1
+# Seconds a write waits for another process holding the lock
+BUSY_TIMEOUT = 5.0
+
+
+class ProbeCache:
+    def __init__(self, directory, max_entries=100000):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, CACHE_FILE)
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, valid INTEGER NOT NULL, used INTEGER NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS verdicts_used ON verdicts (used)")
+        self._clock, self._entries = self._connection.execute(
+            "SELECT COALESCE(MAX(used), 0), COUNT(*) FROM verdicts").fetchone()
+
+    @staticmethod
+    def key(language:str, version:str, source:str) -> str:
+        digest = hashlib.sha256(f"{CACHE_FORMAT}\0{language}\0{version}\0".encode())
+        digest.update(source.encode("utf-8", "surrogateescape"))
+        return digest.hexdigest()
+
+    def get(self, key:str):
+        """Returns the cached verdict, or None on a miss."""
+        with self._lock:
+            row = self._connection.execute("SELECT valid FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._clock += 1
+            self._commit("UPDATE verdicts SET used = ? WHERE key = ?", (self._clock, key))
+            return bool(row[0])
+
+    def put(self, key:str, valid:bool) -> None:
+        with self._lock:
+            self._clock += 1
+            self._entries += self._commit(
+                "INSERT OR IGNORE INTO verdicts (key, valid, used) VALUES (?, ?, ?)", (key, int(valid), self._clock))
+            if self._entries > self.max_entries:
+                excess = self._entries - self.max_entries
+                self._commit("DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ORDER BY used LIMIT ?)",
+                             (excess,))
+                self._entries -= excess
+                self.evictions += excess
+
+    def _commit(self, statement, parameters) -> int:
+        """Runs a write in a transaction of its own, returning the number of rows it changed."""
+        try:
+            changed = self._connection.execute(statement, parameters).rowcount
+            self._connection.commit()
+        except sqlite3.Error:
+            self._connection.rollback()
+            raise
+        return changed
+
+    def __len__(self):
+        return self._entries
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+
+_cache = None
+
+
+def open_cache(directory:str, max_entries:int=100000) -> ProbeCache:
+    global _cache
+    close_cache()
+    _cache = ProbeCache(directory, max_entries)
+    return _cache
+
+
+def get_cache():
+    return _cache
+
+
+@atexit.register
+def close_cache():
+    global _cache
+    if _cache is not None:
+        _cache.close()
+        _cache = None
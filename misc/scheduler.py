@@ -0,0 +1,94 @@
+import contextvars
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+#
+# Section scheduler
+#
+# The language sections of a zip are independent until they are assembled, so each one runs as its own task. Tasks
+# from every zip in the process share one bounded pool of workers, and the pool always picks the most expensive task
+# waiting (the biggest Ruby section, usually), so a zip lasts about as long as its slowest section.
+#
+
+scheduler_settings = {
+    'jobs': 4,
+}
+
+
+class LongestFirstExecutor:
+    def __init__(self, workers, name="section"):
+        self.workers = max(1, workers)
+        self.name = name
+        self._tasks = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._closed = False
+
+    def submit(self, cost, function, *args) -> Future:
+        """Queues `function(*args)`, higher costs first. It runs in a copy of the caller's context."""
+        future = Future()
+        context = contextvars.copy_context()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Scheduler already shut down")
+            heapq.heappush(self._tasks, (-cost, next(self._order), future, context, function, args))
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify()
+        return future
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._tasks and not self._closed:
+                    self._condition.wait()
+                if not self._tasks:
+                    return
+                _, _, future, context, function, args = heapq.heappop(self._tasks)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = context.run(function, *args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def set_section_jobs(jobs:int) -> None:
+    """Sets how many sections run at once across the process. 1 zips the sections one after the other, inline."""
+    global _executor
+    with _executor_lock:
+        scheduler_settings['jobs'] = max(1, jobs)
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+def run_sections(tasks) -> list:
+    """Runs every (cost, function, args) task, returning their results in the same order."""
+    global _executor
+    if scheduler_settings['jobs'] <= 1 or len(tasks) <= 1:
+        return [function(*args) for _, function, args in tasks]
+    with _executor_lock:
+        if _executor is None:
+            _executor = LongestFirstExecutor(scheduler_settings['jobs'])
+        executor = _executor
+    futures = [executor.submit(cost, function, *args) for cost, function, args in tasks]
+    return [future.result() for future in futures]
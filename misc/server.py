@@ -0,0 +1,253 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from misc.checker_pool import health_check_pools
+
+#
+# Zipper daemon
+#
+# Keeps a single process (with its compiled templates, probe caches and warm checkers) serving zip requests, as HTTP
+# over a Unix socket or over TCP on localhost.
+#
+#   POST /zip     {"python": ..., "js": ..., "lua": ..., "ruby": ..., "template": "two"|"three"|"four"}
+#                 -> 200 {"zipped": ..., "seconds": ...}, 400 bad request, 503 queue full, 500 zipper failure
+#   GET /health   -> 200 {"in_flight": ..., "queued": ..., "served": ..., "failed": ...}
+#
+# Only `max_in_flight` zips run at once, up to `max_queued` more wait for their turn and the rest are turned away.
+# Every `health_interval` seconds the idle checker workers are pinged, the dead ones are replaced before a zip needs
+# them (a daemon's workers can sit idle for a long time).
+#
+
+server_settings = {
+    'max_in_flight': 4,
+    'max_queued': 64,
+    'max_request_bytes': 64 * 1024 * 1024,
+    'health_interval': 60.0,
+}
+
+SOURCE_FIELDS = ["python", "js", "lua", "ruby"]
+
+
+class Admission:
+    def __init__(self, max_in_flight, max_queued):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.in_flight = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def enter(self) -> bool:
+        """Waits for a free slot. Returns False (without waiting) when the queue is already full."""
+        with self._condition:
+            if self.in_flight >= self.max_in_flight:
+                if self.queued >= self.max_queued:
+                    return False
+                self.queued += 1
+                while self.in_flight >= self.max_in_flight:
+                    self._condition.wait()
+                self.queued -= 1
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "local"
+
+    def log_message(self, format, *args):
+        if self.server.log:
+            self.server.log(f"{self.address_string()} {format % args}\n")
+
+    def _reply(self, status, answer):
+        body = json.dumps(answer).encode("utf-8", "surrogateescape")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            return self._reply(404, {"error": f"Unknown path ({self.path})"})
+        admission = self.server.admission
+        self._reply(200, {"in_flight": admission.in_flight, "queued": admission.queued,
+                          "served": self.server.served, "failed": self.server.failed})
+
+    def do_POST(self):
+        if self.path != "/zip":
+            return self._reply(404, {"error": f"Unknown path ({self.path})"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > server_settings['max_request_bytes']:
+            self.close_connection = True
+            return self._reply(413, {"error": "Request too large"})
+        try:
+            request = json.loads(self.rfile.read(length).decode("utf-8", "surrogateescape"))
+            sources = [request.get(field) or "" for field in SOURCE_FIELDS]
+            if not all(isinstance(source, str) for source in sources):
+                raise ValueError("sources must be strings")
+            template = request.get("template")
+        except (ValueError, AttributeError) as e:
+            return self._reply(400, {"error": f"Invalid request ({e})"})
+
+        if not self.server.admission.enter():
+            return self._reply(503, {"error": "Too many requests queued"})
+        started = time.perf_counter()
+        try:
+            zipped = self.server.zipper(*sources, template)
+        except Exception as e:
+            self.server.count(failed=True)
+            return self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            self.server.admission.leave()
+        self.server.count(failed=False)
+        self._reply(200, {"zipped": zipped, "seconds": round(time.perf_counter() - started, 6)})
+
+
+class _ServerState:
+    daemon_threads = True
+
+    def setup_state(self, zipper, log):
+        self.zipper = zipper
+        self.log = log
+        self.admission = Admission(server_settings['max_in_flight'], server_settings['max_queued'])
+        self.served = 0
+        self.failed = 0
+        self._counter_lock = threading.Lock()
+
+    def count(self, failed):
+        with self._counter_lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.served += 1
+
+
+class _TCPServer(_ServerState, ThreadingHTTPServer):
+    pass
+
+
+class _UnixServer(_ServerState, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def parse_address(address:str):
+    """`PORT` or `HOST:PORT` for TCP (HOST defaults to localhost), anything else is a Unix socket path."""
+    host, _, port = address.rpartition(":")
+    if port.isdigit() and "/" not in address:
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def _remove_stale_socket(path):
+    """Clears the way for a new socket at `path`, only a socket nobody is listening on anymore is removed."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise Exception(f"SERVER ERROR: {path} exists and is not a socket")
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+        return
+    except OSError as e:
+        raise Exception(f"SERVER ERROR: Can't tell whether {path} is in use ({e})")
+    finally:
+        probe.close()
+    raise Exception(f"SERVER ERROR: Another server is already listening on {path}")
+
+
+def _same_file(path, status) -> bool:
+    try:
+        current = os.lstat(path)
+    except OSError:
+        return False
+    return (current.st_dev, current.st_ino) == (status.st_dev, status.st_ino)
+
+
+def _health_checks(stop, log):
+    while not stop.wait(server_settings['health_interval']):
+        restarted = health_check_pools()
+        if restarted and log:
+            log(f"Restarted {restarted} checker workers\n")
+
+
+def serve(address, zipper, log=None):
+    """Serves `zipper(python, js, lua, ruby, template)` on the address until interrupted (Ctrl+C or SIGTERM)."""
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        server = _TCPServer(address, _Handler)
+    else:
+        _remove_stale_socket(address)
+        server = _UnixServer(address, _Handler)
+        bound = os.lstat(address)
+    server.setup_state(zipper, log)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _interrupt)
+    if log:
+        log(f"Serving on {address}\n")
+    stop = threading.Event()
+    threading.Thread(target=_health_checks, args=(stop, log), name="checker-health", daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        # Only our own socket is removed, another server may have taken the path over meanwhile
+        if not isinstance(address, tuple) and _same_file(address, bound):
+            os.remove(address)
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def zip_remote(address, python_code, js_code, lua_code="", ruby_code="", template=None, timeout=None) -> str:
+    """Asks the daemon at `address` for a zip, raising on any failure."""
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        connection = http.client.HTTPConnection(*address, timeout=timeout)
+    else:
+        connection = _UnixConnection(address, timeout=timeout)
+    body = json.dumps({"python": python_code, "js": js_code, "lua": lua_code, "ruby": ruby_code,
+                       "template": template}).encode("utf-8", "surrogateescape")
+    try:
+        connection.request("POST", "/zip", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        answer = json.loads(response.read().decode("utf-8", "surrogateescape"))
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception(f"SERVER ERROR: {answer.get('error', response.reason)} (status {response.status})")
+    return answer["zipped"]
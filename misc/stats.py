@@ -0,0 +1,120 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+#
+# Instrumentation
+#
+# Every interesting step reports an event: `emit(event, **data)`. Events are aggregated into the module statistics and
+# handed to any subscribed callback `callback(event, data)`, so embedding code can follow a zip as it happens.
+#
+#   * "phase"       name, language, seconds      Wall time of a pipeline phase (template, read, escape, probe...).
+#   * "probe"       language, token               A single syntax probe of a token occurrence (or batch of them).
+#   * "check"       language, backend, seconds    A syntax check, by backend (in_process, pool, subprocess, cache).
+#   * "subprocess"  language, kind                A process launch (a one-off check or a warm worker).
+#   * "bytes"       kind, count                   Bytes handed to checkers or written as output.
+#
+
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000]
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def _empty():
+    return {"phases": {}, "probes": {}, "checks": {}, "subprocesses": {}, "bytes": {}}
+
+
+_stats = _empty()
+
+
+def subscribe(callback) -> None:
+    with _lock:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback) -> None:
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+
+def reset() -> None:
+    global _stats
+    with _lock:
+        _stats = _empty()
+
+
+def emit(event:str, **data) -> None:
+    with _lock:
+        if event == "phase":
+            key = f"{data['name']}[{data['language']}]" if data.get("language") else data["name"]
+            phase = _stats["phases"].setdefault(key, {"count": 0, "seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += data["seconds"]
+        elif event == "probe":
+            key = f"{data['language']} {data['token']}"
+            _stats["probes"][key] = _stats["probes"].get(key, 0) + 1
+        elif event == "check":
+            key = f"{data['language']} {data['backend']}"
+            check = _stats["checks"].setdefault(
+                key, {"count": 0, "seconds": 0.0, "histogram_ms": [0] * (len(LATENCY_BUCKETS_MS) + 1)})
+            check["count"] += 1
+            check["seconds"] += data["seconds"]
+            check["histogram_ms"][bisect.bisect_left(LATENCY_BUCKETS_MS, data["seconds"] * 1000)] += 1
+        elif event == "subprocess":
+            key = f"{data['language']} {data['kind']}"
+            _stats["subprocesses"][key] = _stats["subprocesses"].get(key, 0) + 1
+        elif event == "bytes":
+            _stats["bytes"][data["kind"]] = _stats["bytes"].get(data["kind"], 0) + data["count"]
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        callback(event, data)
+
+
+@contextmanager
+def phase(name:str, language:str=""):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit("phase", name=name, language=language, seconds=time.perf_counter() - started)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return json.loads(json.dumps(_stats))
+
+
+def to_json(extra=None) -> str:
+    report = snapshot()
+    report["latency_buckets_ms"] = LATENCY_BUCKETS_MS
+    report.update(extra or {})
+    return json.dumps(report, indent=2)
+
+
+def to_text(extra=None) -> str:
+    report = snapshot()
+    lines = ["Phases:"]
+    for key, value in sorted(report["phases"].items(), key=lambda item: -item[1]["seconds"]):
+        lines.append(f"  {key:<32} {value['seconds'] * 1000:>10.2f} ms  x{value['count']}")
+    lines.append("Probes:")
+    for key, value in sorted(report["probes"].items()):
+        lines.append(f"  {key:<32} {value:>10}")
+    lines.append("Checks:")
+    labels = [f"<{b:g}" for b in LATENCY_BUCKETS_MS] + [f">={LATENCY_BUCKETS_MS[-1]:g}"]
+    for key, value in sorted(report["checks"].items()):
+        average = value["seconds"] * 1000 / value["count"]
+        histogram = " ".join(f"{label}:{count}" for label, count in zip(labels, value["histogram_ms"]) if count)
+        lines.append(f"  {key:<32} {value['count']:>10}  avg {average:.3f} ms  [{histogram}]")
+    lines.append("Subprocess launches:")
+    for key, value in sorted(report["subprocesses"].items()):
+        lines.append(f"  {key:<32} {value:>10}")
+    lines.append("Bytes:")
+    for key, value in sorted(report["bytes"].items()):
+        lines.append(f"  {key:<32} {value:>10}")
+    for key, value in (extra or {}).items():
+        lines.append(f"{key}: {value}")
+    return "\n".join(lines) + "\n"
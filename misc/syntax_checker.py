@@ -1,6 +1,28 @@
+import atexit
+import bisect
+import contextvars
+import hashlib
+import os
+import shutil
+import sqlite3
 import sys
 import subprocess
 import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Allows running as a script
+
+from misc.checker_pool import WorkerError, get_pool, mark_broken, worker_commands
+from misc.escaping import unique_suffix
+from misc.lexers import classify_occurrences, find_occurrences, find_top_level_cuts
+from misc.plan import escape_plan
+from misc.probe_cache import get_cache
+from misc.stats import emit
+from misc.watch import get_decision_store
 
 check_commands = {
     'py': ["python3", "-m", "py_compile"],
@@ -9,32 +31,479 @@ check_commands = {
     'lua': ["luac", "-p"]
 }
 
-def check_syntax(language:str, _filename:str) -> bool:
-    return _check_syntax(check_commands[language], _filename)
+check_suffixes = {
+    'javascript': ".js"
+}
+
+#
+# In-process checkers
+#
+# A checker is a callable that receives the source text and returns whether it is valid. Languages with a registered
+# checker never fork nor touch the disk; every other language falls back to `check_commands`.
+#
+
+in_process_checkers = {}
+
+def register_checker(language:str, checker) -> None:
+    in_process_checkers[language] = checker
+    _checker_versions.pop(language, None)
+
+def unregister_checker(language:str) -> None:
+    in_process_checkers.pop(language, None)
+    _checker_versions.pop(language, None)
+
+def _python_checker(source:str) -> bool:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            compile(source, "<probe>", "exec", dont_inherit=True)
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        return False
+    else:
+        return True
+
+_checker_versions = {}
+
+register_checker('py', _python_checker)
+
+
+# Version managers whose shims pick the interpreter when they run: {manager: (version variable, local version file)}
+_SHIM_MANAGERS = {
+    "rbenv": ("RBENV_VERSION", ".ruby-version"),
+    "pyenv": ("PYENV_VERSION", ".python-version"),
+    "nodenv": ("NODENV_VERSION", ".node-version"),
+}
+
+_executable_versions = {}
+_executable_versions_lock = threading.Lock()
+
+
+def _local_version(file_name):
+    directory = os.getcwd()
+    while True:
+        try:
+            with open(os.path.join(directory, file_name), "r") as version_file:
+                return version_file.read()
+        except OSError:
+            pass
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _shim_target(shim, name):
+    """The interpreter an rbenv/pyenv/nodenv shim runs (picked the way the manager picks it), None if unsure."""
+    shims = os.path.dirname(shim)
+    root = os.path.dirname(shims)
+    manager = os.path.basename(root).lstrip(".")
+    if os.path.basename(shims) != "shims" or manager not in _SHIM_MANAGERS:
+        return None
+    variable, file_name = _SHIM_MANAGERS[manager]
+    versions = os.environ.get(variable) or _local_version(file_name)
+    if versions is None:
+        try:
+            with open(os.path.join(root, "version"), "r") as version_file:
+                versions = version_file.read()
+        except OSError:
+            return None
+    for version in versions.replace(":", " ").split():
+        for candidate in [version, version.removeprefix("ruby-")]:
+            target = os.path.join(root, "versions", candidate, "bin", name)
+            if os.path.isfile(target):
+                return target
+    return None
 
-def _check_syntax(args: list[str], _filename:str) -> bool:
+
+def executable_version(name:str) -> str:
+    """
+    Identifies the interpreter a command name runs: its resolved path, size and mtime. Shims go to the interpreter
+    they pick, asking it (`-v`) only if the version manager is not a known one. Computed once per name.
+    """
+    with _executable_versions_lock:
+        if name not in _executable_versions:
+            _executable_versions[name] = _executable_version(name)
+        return _executable_versions[name]
+
+
+def _executable_version(name):
+    executable = shutil.which(name) or name
     try:
-        subprocess.run([*args, _filename], check=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+        path = os.path.realpath(executable)
+        stat = os.stat(path)
+        with open(path, "rb") as executable_file:
+            script = executable_file.read(2) == b"#!"
+    except OSError:
+        return executable
+    version = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    if not script:
+        return version
+    if (target := _shim_target(path, os.path.basename(executable))) is not None:
+        return f"{version}:{_executable_version(target)}"
+    # Other shims (asdf...) are only known by the interpreter they run
+    try:
+        result = subprocess.run([executable, "-v"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=10)
+        version += ":" + result.stdout.decode("utf-8", "replace").strip()
+    except (OSError, subprocess.TimeoutExpired):
+        pass
+    return version
+
+
+def checker_version(language:str) -> str:
+    """
+    Identifies every checker that may answer for a language (used to key cached verdicts): the in-process one, or
+    both the warm worker (interpreter and script) and the one-off checker command.
+    """
+    if language not in _checker_versions:
+        if language in in_process_checkers:
+            checker = in_process_checkers[language]
+            version = f"{checker.__module__}.{checker.__qualname__}:{sys.version}"
+        else:
+            version = executable_version(check_commands[language][0])
+            if language in worker_commands:
+                command = worker_commands[language]
+                script = hashlib.sha256("\0".join(command[1:]).encode()).hexdigest()
+                version += f"|{executable_version(command[0])}:{script}"
+        _checker_versions[language] = version
+    return _checker_versions[language]
+
+
+def check_syntax(language:str, _filename:str=None, source:str=None) -> bool:
+    if source is not None and (cache := get_cache()) is not None:
+        started = time.perf_counter()
+        key = cache.key(language, checker_version(language), source)
+        # A cache that can't be read (locked by another zip for too long, broken file) is a miss, never a failed zip
+        try:
+            valid = cache.get(key)
+        except sqlite3.Error:
+            valid = None
+        if valid is None:
+            valid = _check_syntax_uncached(language, _filename, source)
+            try:
+                cache.put(key, valid)
+            except sqlite3.Error:
+                pass
+        else:
+            emit("check", language=language, backend="cache", seconds=time.perf_counter() - started)
+        return valid
+    return _check_syntax_uncached(language, _filename, source)
+
+# An object with `check(language, source)` and `checkpoint()` that takes over every check not done in-process, for
+# the zip running in the current context (see `misc.async_checker`)
+check_router = contextvars.ContextVar("check_router", default=None)
+
+def _check_syntax_uncached(language:str, _filename:str=None, source:str=None) -> bool:
+    started = time.perf_counter()
+    if (router := check_router.get()) is not None:
+        router.checkpoint()
+
+    if language in in_process_checkers:
+        if source is None:
+            with open(_filename, "r") as _file:
+                source = _file.read()
+        valid = in_process_checkers[language](source)
+        emit("check", language=language, backend="in_process", seconds=time.perf_counter() - started)
+        return valid
+
+    if router is not None:
+        if source is None:
+            with open(_filename, "r") as _file:
+                source = _file.read()
+        valid = router.check(language, source)
+        emit("check", language=language, backend="async", seconds=time.perf_counter() - started)
+        return valid
+
+    if (pool := get_pool(language)) is not None:
+        if source is None:
+            with open(_filename, "r") as _file:
+                source = _file.read()
+        try:
+            valid = pool.check(source)
+        except (WorkerError, OSError):
+            # Warm workers are an optimization, fall back to one process per check from now on
+            mark_broken(language)
+        else:
+            emit("check", language=language, backend="pool", seconds=time.perf_counter() - started)
+            return valid
+
+    if source is not None:
+        valid = _check_source(language, source)
+    else:
+        valid = _check_syntax(check_commands[language], _filename)
+    emit("check", language=language, backend="subprocess", seconds=time.perf_counter() - started)
+    return valid
+
+def _check_syntax(args: list[str], _filename:str, **kwargs) -> bool:
+    emit("subprocess", language=args[0], kind="check")
+    try:
+        subprocess.run([*args, _filename], check=True, stderr=subprocess.PIPE, stdout=subprocess.PIPE, **kwargs)
     except subprocess.CalledProcessError:
         return False
     else:
         return True
 
+
+#
+# Probe I/O
+#
+# Sources are handed to the checkers without touching the disk: through stdin for those that read it the same way as
+# a file, otherwise through an anonymous in-memory file (memfd) exposed as /proc/self/fd/N. Systems without memfd
+# reuse one scratch file per thread, preferably on tmpfs, removed on exit.
+#
+
+stdin_commands = {
+    'ruby': ["ruby", "-c"],
+    'lua': ["luac", "-p"],
+}
+
+# node resolves the main script to its real path, which doesn't exist for a memfd
+memfd_commands = {
+    'javascript': ["node", "--preserve-symlinks", "--preserve-symlinks-main", "--check"],
+}
+
+_use_memfd = hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd")
+_scratch = threading.local()
+_scratch_files = []
+
+def _scratch_file(suffix):
+    paths = getattr(_scratch, "paths", None)
+    if paths is None:
+        paths = _scratch.paths = {}
+    if suffix not in paths:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        handle, paths[suffix] = tempfile.mkstemp(prefix="probe", suffix=suffix, dir=directory)
+        os.close(handle)
+        _scratch_files.append(paths[suffix])
+    return paths[suffix]
+
+@atexit.register
+def _remove_scratch_files():
+    for path in _scratch_files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _check_source(language:str, source:str) -> bool:
+    data = source.encode("utf-8", "surrogateescape")
+    emit("bytes", kind="probe_input", count=len(data))
+    if language in stdin_commands:
+        return _check_syntax(stdin_commands[language], "-", input=data)
+
+    if _use_memfd:
+        fd = os.memfd_create(f"probe{check_suffixes.get(language, '.txt')}")
+        try:
+            with open(fd, "wb", closefd=False) as memory_file:
+                memory_file.write(data)
+            command = memfd_commands.get(language, check_commands[language])
+            return _check_syntax(command, f"/proc/self/fd/{fd}", pass_fds=(fd,))
+        finally:
+            os.close(fd)
+
+    scratch = _scratch_file(check_suffixes.get(language, '.txt'))
+    with open(scratch, "wb") as scratch_file:
+        scratch_file.write(data)
+    return _check_syntax(check_commands[language], scratch)
+
+#
+# Probe executor
+#
+# Probes are independent from each other, so they can run concurrently. Threads are enough, as the heavy lifting
+# happens in the checker processes. Results always come back in occurrence order.
+#
+
+probe_settings = {
+    'jobs': 1,
+    'classifier': 'probe',
+    'strategy': 'single',
+    'window': False,
+    'window_threshold': 16384,
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def set_probe_jobs(jobs:int) -> None:
+    global _executor
+    with _executor_lock:
+        probe_settings['jobs'] = max(1, jobs)
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+def map_probes(probe, items) -> list:
+    global _executor
+    items = list(items)
+    # Probes started from a probe thread run inline, waiting on the same executor could exhaust it
+    nested = threading.current_thread().name.startswith("probe")
+    if probe_settings['jobs'] <= 1 or len(items) <= 1 or nested:
+        return [probe(item) for item in items]
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=probe_settings['jobs'], thread_name_prefix="probe")
+        executor = _executor
+    # Each probe runs in a copy of the caller's context, which may route its checks elsewhere
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(executor.map(lambda context, item: context.run(probe, item), contexts, items))
+
+
+#
+# Lexer classifier
+#
+# For some breakers, whether an occurrence breaks only depends on the region it sits in, which `misc.lexers` can tell
+# without compiling. The rest (and every ambiguous region) still go through the probes.
+#
+#   * "probe"       Every occurrence is probed (default).
+#   * "lexer"       Only the occurrences the lexer can't decide are probed.
+#   * "crosscheck"  Every occurrence is probed and the lexer decisions are compared against them.
+#
+
+classifier_modes = ["probe", "lexer", "crosscheck"]
+
+_literal_region_verdicts = {"comment": True, "string": True, "sq_string": True, "raw": True, "regex": True,
+                            "heredoc": True}
+
+# Whether the breaker keeps the syntax valid (the occurrence is "optional"), for each region kind.
+lexer_verdicts = {
+    # Junk outside of literals always breaks, inside of them it's just text
+    "p811p<>": {**_literal_region_verdicts, "code": False},
+    # A single quote closes single-quoted strings, but what follows may still parse (`p '"""' # '` becomes
+    # `p ''' # '`), so those are probed
+    "'": {**_literal_region_verdicts, "sq_string": None},
+    "'/": {**_literal_region_verdicts, "sq_string": None},
+    # Dropping a `/` is harmless inside literals that don't use it as a delimiter
+    "*": dict(_literal_region_verdicts),
+}
+
+lexer_mismatches = []
+
+def set_classifier(mode:str) -> None:
+    if mode not in classifier_modes:
+        raise Exception(f"CHECKER ERROR: Invalid classifier ({mode})")
+    probe_settings['classifier'] = mode
+
+def lexer_classification(body, language, token, breaker) -> list:
+    """Returns, per occurrence, whether the breaker keeps the syntax valid (True/False) or None if undecided."""
+    verdicts = lexer_verdicts.get(breaker)
+    if verdicts is None:
+        return [None] * body.count(token)
+    return [verdicts.get(kind) for kind in classify_occurrences(body, language, token)]
+
+
+#
+# Probe strategies
+#
+#   * "single"  One compilation per occurrence (default).
+#   * "bisect"  Breaks a whole batch of occurrences at once. If the file still compiles, every one of them is optional,
+#               otherwise the batch is split in halves. Costs about O(k log N) compilations when k occurrences matter.
+#
+# Group testing is only sound when breakers can't make up for each other: two `'` could open and close a string, and
+# two dropped regex terminators could merge a pair of regexes. Other breakers always use the "single" strategy.
+#
+
+probe_strategies = ["single", "bisect"]
+group_safe_breakers = {"p811p<>"}
+
+def set_probe_strategy(strategy:str) -> None:
+    if strategy not in probe_strategies:
+        raise Exception(f"CHECKER ERROR: Invalid probe strategy ({strategy})")
+    probe_settings['strategy'] = strategy
+
+def group_replacement_breaks(parts, positions, language, token, replacement) -> bool:
+    emit("probe", language=language, token=token)
+    broken = set(positions)
+    changed = ''.join(p + (replacement if n in broken else token) for n, p in enumerate(parts[:-1])) + parts[-1]
+    return not check_syntax(language, source=changed)
+
+def bisect_probes(parts, positions, language, token, replacement) -> dict:
+    """Returns, for each position, whether the replacement keeps the syntax valid (the same as `single` would)."""
+    positions = list(positions)
+    if not positions:
+        return {}
+    if not group_replacement_breaks(parts, positions, language, token, replacement):
+        return {n: True for n in positions}
+    if len(positions) == 1:
+        return {positions[0]: False}
+    half = len(positions) // 2
+    halves = map_probes(lambda group: bisect_probes(parts, group, language, token, replacement),
+                        [positions[:half], positions[half:]])
+    return {**halves[0], **halves[1]}
+
+
+#
+# Windowed probes
+#
+# Instead of the whole file, only the top-level statements around an occurrence are compiled. A window is only trusted
+# if it compiles on its own before breaking it, and if the window grown by one statement on each side (its context)
+# gives the same verdict; otherwise the probe falls back to the whole file. A broken window is only trusted for the
+# group-safe breakers too: a stray quote or regex terminator may be closed by a far away one in the whole file. Sources
+# that don't compile as a whole, and those smaller than `window_threshold`, are always compiled whole.
+#
+
+def set_windowed_probes(enabled:bool, threshold:int=None) -> None:
+    probe_settings['window'] = enabled
+    if threshold is not None:
+        probe_settings['window_threshold'] = threshold
+
+def windowed_probe(body, language, token, replacement):
+    """Returns a `probe(n)` that tells whether breaking occurrence n breaks the syntax, compiling windows if possible."""
+    cuts = find_top_level_cuts(body, language)
+    offsets = find_occurrences(body, token)
+    windows = {}
+    parts = None
+    # Windows of a file that doesn't compile as a whole may compile, the whole file is the only reference then
+    if not check_syntax(language, source=body):
+        cuts = [0, len(body)]
+
+    def window_breaks(start, end, offset):
+        # None when the window is the whole file or doesn't stand on its own
+        if (start, end) == (0, len(body)):
+            return None
+        if (start, end) not in windows:
+            windows[(start, end)] = check_syntax(language, source=body[start:end])
+        if not windows[(start, end)]:
+            return None
+        changed = body[start:offset] + replacement + body[offset + len(token):end]
+        return not check_syntax(language, source=changed)
+
+    def probe(n):
+        nonlocal parts
+        emit("probe", language=language, token=token)
+        offset = offsets[n]
+        first = bisect.bisect_right(cuts, offset) - 1
+        last = bisect.bisect_left(cuts, offset + len(token))
+        breaks = window_breaks(cuts[first], cuts[last], offset)
+        if breaks is not None and (not breaks or replacement in group_safe_breakers) and \
+                breaks == window_breaks(cuts[max(0, first - 1)], cuts[min(len(cuts) - 1, last + 1)], offset):
+            return breaks
+        # Inconclusive: the window doesn't stand on its own, its context disagrees or the breaker reaches further
+        if parts is None:
+            parts = body.split(token)
+        return _replacement_breaks(parts, n, language, token, replacement)
+
+    return probe
+
+
 def single_replacement_breaks(parts, position, language, token, replacement) :
-    suffix = ".js"  if language == "javascript" else '.txt'
+    emit("probe", language=language, token=token)
+    return _replacement_breaks(parts, position, language, token, replacement)
+
+def _replacement_breaks(parts, position, language, token, replacement) :
     start = token.join(parts[:position+1])
     finish = token.join(parts[position+1:])
     changed = start + replacement  + finish
-    with tempfile.NamedTemporaryFile(mode='w+', suffix=suffix, delete=False) as temp_file:
-        temp_file.write(changed)
-        temp_file.flush()
-        # If the syntax is still valid, it was inside a regex or something like that
-        _answer = not check_syntax(language, temp_file.name)
-    return _answer
+    # If the syntax is still valid, it was inside a regex or something like that
+    return not check_syntax(language, source=changed)
 
 
 def reformat_strings_and_replace_tokens(
-        body, language, token, potential_breaker, negative_replacement, positive_replacement, unique_replacement, focused_parts):
+        body, language, token, potential_breaker, negative_replacement, positive_replacement, unique_replacement, focused_parts,
+        known=None):
+    """
+    Replaces each occurrence of `token` with `negative_replacement` if the breaker keeps the syntax valid there, or with
+    `positive_replacement` otherwise. `known` maps occurrence numbers to verdicts that don't need to be probed again.
+    """
 
     if token == "":
         return body, focused_parts
@@ -45,26 +514,107 @@ def reformat_strings_and_replace_tokens(
 
     part_focused = lambda n: not focused_parts or n in focused_parts
 
-    optional = [not single_replacement_breaks(parts, n, language, token, potential_breaker) and part_focused(n)
-                for n in range(len(parts) - 1)]
+    mode = probe_settings['classifier']
+    decided = [None] * (len(parts) - 1)
+    if mode != "probe":
+        decided = lexer_classification(body, language, token, potential_breaker)
+
+    known = known or {}
+    if (plan := escape_plan.get()) is not None:
+        plan_stage = plan.stage(language, token, potential_breaker)
+        if plan.replaying:
+            known = dict(enumerate(plan.verdicts(plan_stage, len(parts) - 1)))
+    # A replayed stage knows every verdict, nothing is compiled (the decision store needs to know whether it compiles)
+    if (store := get_decision_store()) is not None and not (plan is not None and plan.replaying):
+        offsets = find_occurrences(body, token)
+        valid = check_syntax(language, source=body)
+        stage, remembered = store.known(language, token, potential_breaker, body, offsets, valid)
+        known = {**remembered, **known}
+
+    pending = [n for n in range(len(parts) - 1) if n not in known and (mode == "crosscheck" or decided[n] is None)]
+    # Windows compile the whole body up front, they are only set up when there is something left to probe
+    if not pending:
+        probed = {}
+    elif probe_settings['strategy'] == "bisect" and potential_breaker in group_safe_breakers:
+        probed = bisect_probes(parts, pending, language, token, potential_breaker)
+    elif probe_settings['window'] and len(body) >= probe_settings['window_threshold']:
+        breaks = windowed_probe(body, language, token, potential_breaker)
+        probed = dict(zip(pending, map_probes(lambda n: not breaks(n), pending)))
+    else:
+        probed = dict(zip(pending, map_probes(
+            lambda n: not single_replacement_breaks(parts, n, language, token, potential_breaker), pending)))
+
+    if mode == "crosscheck":
+        for n, verdict in enumerate(decided):
+            if verdict is not None and n in probed and verdict != probed[n]:
+                lexer_mismatches.append((language, token, potential_breaker, len(token.join(parts[:n + 1]))))
+                sys.stderr.write(f"LEXER MISMATCH: {language} `{token}` occurrence {n} (breaker `{potential_breaker}`)"
+                                 f" lexer={verdict} probe={probed[n]}\n")
+
+    probed.update(known)
+    verdicts = [probed[n] if n in probed else decided[n] for n in range(len(parts) - 1)]
+    if store is not None:
+        store.record(stage, body, offsets, verdicts, valid)
+    if plan is not None and not plan.replaying:
+        plan.record(plan_stage, verdicts)
+
+    optional = [verdict and part_focused(n) for n, verdict in enumerate(verdicts)]
 
     if all([o or not part_focused(o) for o in optional]):
         return body.replace(token, negative_replacement), optional
 
-    reformatted_body = ""
-    for n,p in enumerate(parts[:-1]):
-        reformatted_body += p + (negative_replacement if optional[n] else token)
-    reformatted_body += parts[-1]
+    if unique_replacement:
+        reformatted_body = join_parts(parts, optional, negative_replacement, token)
+        positive_replacement = unique_suffix(reformatted_body, positive_replacement)
+
+    return join_parts(parts, optional, negative_replacement, positive_replacement), optional
+
+def _shift_verdicts(verdicts, edits, token_length):
+    """Moves {offset: verdict} past the edits (start, end, new length), dropping the occurrences they touch."""
+    shifted = {}
+    starts = [start for start, _, _ in edits]
+    deltas = [0]
+    for start, end, length in edits:
+        deltas.append(deltas[-1] + length - (end - start))
+    for offset, verdict in verdicts.items():
+        index = bisect.bisect_right(starts, offset + token_length)
+        if index > 0 and edits[index - 1][1] >= offset:
+            continue
+        shifted[offset + deltas[index]] = verdict
+    return shifted
+
+def incremental_fixpoint(body, language, token, passes):
+    """
+    Runs the rewrite passes [(breaker, positive replacement)] over `body` until a whole round changes nothing.
 
-    while unique_replacement and positive_replacement in reformatted_body:
-        positive_replacement += "x"
+    The rewrites keep every string boundary where it was, so an occurrence keeps its verdict until an edit touches it.
+    Each pass only probes new occurrences or the ones next to an edit made since the last pass with the same breaker,
+    which also makes the final round, the one confirming that nothing changes, free.
+    """
+    verdicts = {}
+    changed = True
+    while changed:
+        changed = False
+        for breaker, positive_replacement in passes:
+            offsets = find_occurrences(body, token)
+            previous = verdicts.get(breaker, {})
+            known = {n: previous[offset] for n, offset in enumerate(offsets) if offset in previous}
+            body, optional = reformat_strings_and_replace_tokens(
+                body, language, token, breaker, token, positive_replacement, False, [], known)
 
-    new_body = ""
-    for n, p in enumerate(parts[:-1]):
-        new_body += p + (negative_replacement if optional[n] else positive_replacement)
-    new_body += parts[-1]
+            edits = [(offset, offset + len(token), len(positive_replacement))
+                     for offset, o in zip(offsets, optional) if not o]
+            verdicts[breaker] = dict(zip(offsets, optional))
+            if edits:
+                changed = True
+                verdicts = {b: _shift_verdicts(v, edits, len(token)) for b, v in verdicts.items()}
+    return body
 
-    return new_body, optional
+def join_parts(parts, optional, negative_replacement, positive_replacement):
+    pieces = [None] * (2 * len(parts) - 1)
+    pieces[::2] = parts
+    pieces[1::2] = [negative_replacement if o else positive_replacement for o in optional]
+    return ''.join(pieces)
 
 def generic_token_replacement(body, language, token):
     return reformat_strings_and_replace_tokens(
@@ -0,0 +1,84 @@
+import os
+import threading
+
+#
+# Compiled templates
+#
+# A template is parsed once into its language profile and the pieces around each placeholder, then cached by path
+# and modification time. Zipping with a compiled template doesn't touch the template file again.
+#
+
+LANGUAGE_TAGS = [('python', '<PYTHON CODE>'), ('lua', '<LUA CODE>'), ('javascript', '<JS CODE>'), ("ruby", "<RUBY CODE>")]
+DIVISION = "<DIVISION>"
+RUBY_TOKEN = "ruby_long_string"
+
+# Sequences that would close another language's hiding block, no matter which template is used
+FORBIDDEN_TOKENS = {
+    'python': {"*/", "]===]"},
+    'javascript': {'"""', "]===]"},
+    'lua': {'"""', "*/"},
+    'ruby': {'"""', "]===]", "*/"},
+}
+
+
+class Template:
+    def __init__(self, template_str, path=""):
+        self.path = path
+        self.profile = profile_template_str(template_str)
+        if template_str[:1] == "~":
+            template_str = '\n'.join(template_str.split('\n')[1:])
+        self.parts = template_str.split(DIVISION)
+        tags = dict(LANGUAGE_TAGS)
+        # Pieces of each division around its placeholder, the code goes in between
+        self.pieces = [self.parts[n].split(tags[language]) for n, language in enumerate(self.profile)]
+        self.offsets = {language: (n, self.parts[n].find(tags[language])) for n, language in enumerate(self.profile)}
+        self.ruby_token = RUBY_TOKEN if "ruby" in self.profile else ""
+        self.forbidden = {
+            language: FORBIDDEN_TOKENS[language] | ({self.ruby_token} if self.ruby_token and language != "ruby" else set())
+            for language in self.profile}
+
+    def fill(self, n, code):
+        return code.join(self.pieces[n])
+
+    def __repr__(self):
+        return f"Template({self.path!r}, {self.profile})"
+
+
+def profile_template_str(template_str):
+    profile = {}
+    parts = template_str.split(DIVISION)
+    for n,part in enumerate(parts):
+        total = 0
+        for lan,tag in LANGUAGE_TAGS:
+            if tag in part:
+                if lan in profile:
+                    raise Exception(f'TEMPLATE ERROR: Same tag ({tag}) appears more than once. (Found on {profile[lan]} and {n}))')
+                profile[lan] = n
+                total += 1
+        if total == 0:
+            raise Exception(f'TEMPLATE ERROR: Tag-less piece of code. \n (Division number {n})')
+        if total > 1:
+            raise Exception(f'TEMPLATE ERROR: One division has more than one tag. \n (Division number {n})')
+
+    return [l for _,l in sorted([(n,l) for l,n in profile.items()])]
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def load_template(template_file) -> Template:
+    """Returns the compiled template for a path, re-reading it only when the file changes."""
+    if isinstance(template_file, Template):
+        return template_file
+    stat = os.stat(template_file)
+    key = os.path.abspath(template_file)
+    with _templates_lock:
+        cached = _templates.get(key)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+    with open(template_file, "r") as template:
+        compiled = Template(template.read(), template_file)
+    with _templates_lock:
+        _templates[key] = ((stat.st_mtime_ns, stat.st_size), compiled)
+    return compiled
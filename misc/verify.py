@@ -0,0 +1,108 @@
+import difflib
+import os
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from misc.syntax_checker import check_commands, check_suffixes
+
+#
+# Verification
+#
+# Checks a finished polyglot with the syntax checker of every language in its template, all at once, so verifying
+# takes about as long as the slowest checker. Optionally runs the original programs and the polyglot with each
+# interpreter too, and diffs their stdout. Every process is killed after `timeout` seconds.
+#
+
+CHECKER_LANGUAGES = {'python': 'py', 'javascript': 'javascript', 'lua': 'lua', 'ruby': 'ruby'}
+
+run_commands = {
+    'python': ["python3"],
+    'javascript': ["node"],
+    'lua': ["lua"],
+    'ruby': ["ruby"],
+}
+
+
+def _run(command, timeout):
+    """Returns (return code, stdout, error), the error being set when the process didn't finish."""
+    try:
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None, "", f"Timed out after {timeout}s"
+    except OSError as e:
+        return None, "", f"{type(e).__name__}: {e}"
+    return result.returncode, result.stdout.decode("utf-8", "replace"), None
+
+
+def _check(language, path, timeout):
+    started = time.perf_counter()
+    code, _, error = _run([*check_commands[CHECKER_LANGUAGES[language]], path], timeout)
+    return {"valid": code == 0 if error is None else None, "error": error,
+            "seconds": round(time.perf_counter() - started, 6)}
+
+
+def _compare(language, original, zipped, timeout, executor):
+    started = time.perf_counter()
+    expected = executor.submit(_run, [*run_commands[language], original], timeout)
+    _, zipped_output, zipped_error = _run([*run_commands[language], zipped], timeout)
+    _, original_output, original_error = expected.result()
+    error = original_error or zipped_error
+    matches = error is None and original_output == zipped_output
+    diff = "" if matches else ''.join(difflib.unified_diff(
+        original_output.splitlines(keepends=True), zipped_output.splitlines(keepends=True), "original", "zipped"))
+    return {"matches": matches if error is None else None, "error": error, "diff": diff,
+            "seconds": round(time.perf_counter() - started, 6)}
+
+
+def verify(zipped:str, profile, originals=None, timeout:float=30.0) -> dict:
+    """
+    Checks `zipped` with the checker of every language in `profile`. With `originals` ({language: path}), also runs
+    those programs and the polyglot, comparing their stdout. Returns the report, `ok` only if everything passed.
+    """
+    started = time.perf_counter()
+    originals = {language: path for language, path in (originals or {}).items() if path and language in profile}
+    with tempfile.TemporaryDirectory(prefix="verify") as directory:
+        paths = {}
+        for language in profile:
+            suffix = check_suffixes.get(CHECKER_LANGUAGES[language], ".txt")
+            if suffix not in paths:
+                paths[suffix] = os.path.join(directory, "zipped" + suffix)
+                with open(paths[suffix], "w") as zipped_file:
+                    zipped_file.write(zipped)
+
+        # Enough workers for every check and both sides of every run, nothing waits for a free one
+        with ThreadPoolExecutor(max_workers=len(profile) + 2 * len(originals)) as executor:
+            checks = {
+                language: executor.submit(
+                    _check, language, paths[check_suffixes.get(CHECKER_LANGUAGES[language], ".txt")], timeout)
+                for language in profile}
+            runs = {
+                language: executor.submit(
+                    _compare, language, path, paths[check_suffixes.get(CHECKER_LANGUAGES[language], ".txt")],
+                    timeout, executor)
+                for language, path in originals.items()}
+            report = {
+                "checks": {language: check.result() for language, check in checks.items()},
+                "runs": {language: run.result() for language, run in runs.items()},
+            }
+
+    report["ok"] = all(check["valid"] for check in report["checks"].values()) and \
+        all(run["matches"] for run in report["runs"].values())
+    report["seconds"] = round(time.perf_counter() - started, 6)
+    return report
+
+
+def format_report(report) -> str:
+    lines = [f"Verification {'passed' if report['ok'] else 'FAILED'} in {report['seconds']:.3f}s"]
+    for language, check in report["checks"].items():
+        state = check["error"] or ("valid" if check["valid"] else "INVALID")
+        lines.append(f"  syntax  {language:<12} {state} ({check['seconds']:.3f}s)")
+    for language, run in report["runs"].items():
+        state = run["error"] or ("same output" if run["matches"] else "DIFFERENT OUTPUT")
+        lines.append(f"  run     {language:<12} {state} ({run['seconds']:.3f}s)")
+        if run["diff"]:
+            lines.extend("    " + line for line in run["diff"].splitlines())
+    return "\n".join(lines) + "\n"
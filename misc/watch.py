@@ -0,0 +1,187 @@
+import bisect
+import difflib
+import os
+import threading
+import time
+
+from misc.lexers import find_regions
+
+#
+# Watch mode
+#
+# Rebuilds the polyglot every time one of its inputs changes. Between builds, every rewrite stage remembers the text
+# it saw and the decision taken for each occurrence. On the next build, the stage input is diffed line by line against
+# the previous one and only the occurrences inside (or next to) edited hunks are probed again. An edit can also turn
+# far away lines into a string or a comment (opening a `"""`), so a decision is only reused if the lexer still sees
+# the occurrence in the same literal (or in code at the same bracket depth).
+#
+
+class DecisionStore:
+    def __init__(self):
+        self._stages = {}
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.reused = 0
+
+    def begin_build(self):
+        with self._lock:
+            self._seen = {}
+            self.reused = 0
+
+    def _stage(self, language, token, breaker):
+        # The same stage can run more than once per build (the Ruby fixpoint), they are told apart by their order
+        with self._lock:
+            key = (language, token, breaker)
+            index = self._seen.get(key, 0)
+            self._seen[key] = index + 1
+            return key + (index,)
+
+    def known(self, language, token, breaker, body, offsets, valid):
+        """
+        Returns the stage key and the reusable {occurrence number: verdict} for the stage about to run. `valid` tells
+        whether `body` compiles as it is: probes of a broken file say something else, nothing is reused across that.
+        """
+        stage = self._stage(language, token, breaker)
+        previous = self._stages.get(stage)
+        if previous is None:
+            return stage, {}
+        old_body, old_verdicts, old_valid = previous
+        if not (valid and old_valid):
+            return stage, {}
+        moved = _carry_offsets(old_body, body, old_verdicts, len(token))
+        candidates = {n: moved[offset] for n, offset in enumerate(offsets) if offset in moved}
+        if candidates and old_body != body:
+            old_contexts = _contexts(old_body, language, candidates.values())
+            new_contexts = _contexts(body, language, [offsets[n] for n in candidates])
+            candidates = {n: old for n, old in candidates.items()
+                          if old_contexts[old] is not None and old_contexts[old] == new_contexts[offsets[n]]}
+        known = {n: old_verdicts[old] for n, old in candidates.items()}
+        with self._lock:
+            self.reused += len(known)
+        return stage, known
+
+    def record(self, stage, body, offsets, verdicts, valid):
+        self._stages[stage] = (body, dict(zip(offsets, verdicts)), valid)
+
+
+def _carry_offsets(old_body, new_body, verdicts, token_length):
+    """Maps the offsets of {offset: verdict} that sit in untouched lines to their new ones, {new offset: old offset}."""
+    if old_body == new_body:
+        return {offset: offset for offset in verdicts}
+    old_lines = old_body.splitlines(keepends=True)
+    new_lines = new_body.splitlines(keepends=True)
+    old_starts = [0]
+    for line in old_lines:
+        old_starts.append(old_starts[-1] + len(line))
+    new_starts = [0]
+    for line in new_lines:
+        new_starts.append(new_starts[-1] + len(line))
+
+    # Unchanged blocks, one line shorter at each side facing an edit
+    blocks = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            continue
+        first = i1 + (1 if i1 > 0 else 0)
+        last = i2 - (1 if i2 < len(old_lines) else 0)
+        if first < last:
+            blocks.append((old_starts[first], old_starts[last], new_starts[j1 + first - i1] - old_starts[first]))
+
+    carried = {}
+    block_starts = [start for start, _, _ in blocks]
+    for offset in verdicts:
+        index = bisect.bisect_right(block_starts, offset) - 1
+        if index >= 0 and offset + token_length <= blocks[index][1]:
+            carried[offset + blocks[index][2]] = offset
+    return carried
+
+
+def _contexts(body, language, offsets):
+    """
+    The lexical context of every offset: the region around it (relative to the offset) or the bracket depth of the
+    code it sits in. None when the lexer can't tell.
+    """
+    regions = find_regions(body, language)
+    contexts = {}
+    depth = 0
+    position = 0
+    index = 0
+    for offset in sorted(set(offsets)):
+        while index < len(regions) and regions[index][1] <= offset:
+            depth = _bracket_depth(body, position, regions[index][0], depth)
+            position = max(position, regions[index][1])
+            index += 1
+        if index < len(regions) and regions[index][0] <= offset:
+            start, end, inner_start, inner_end, kind = regions[index]
+            contexts[offset] = None if kind is None else \
+                (kind, start - offset, end - offset, inner_start - offset, inner_end - offset)
+        else:
+            depth = _bracket_depth(body, position, offset, depth)
+            position = offset
+            contexts[offset] = ("code", depth)
+    return contexts
+
+
+def _bracket_depth(body, start, end, depth):
+    for c in body[start:end]:
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth = max(0, depth - 1)
+    return depth
+
+
+_store = None
+
+
+def get_decision_store():
+    return _store
+
+
+def enable_decision_store() -> DecisionStore:
+    global _store
+    if _store is None:
+        _store = DecisionStore()
+    return _store
+
+
+def disable_decision_store() -> None:
+    global _store
+    _store = None
+
+
+def watch(paths, build, interval=0.5, log=None):
+    """Runs `build()` once, and again every time one of the paths changes. Stops on Ctrl+C."""
+    store = enable_decision_store()
+    paths = [path for path in paths if path]
+
+    def snapshot():
+        stamps = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        return stamps
+
+    stamps = None
+    try:
+        while True:
+            current = snapshot()
+            if current != stamps:
+                stamps = current
+                started = time.perf_counter()
+                store.begin_build()
+                try:
+                    build()
+                except Exception as e:
+                    if log:
+                        log(f"Build failed: {type(e).__name__}: {e}\n")
+                else:
+                    if log:
+                        log(f"Built in {time.perf_counter() - started:.3f}s ({store.reused} decisions reused)\n")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
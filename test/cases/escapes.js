@@ -0,0 +1,4 @@
+console.log("a\x22\x22\x22b")
+console.log('a\x22\x22\x22b')
+console.log("c\x2A/d")
+console.log("e]=\x3D=]f")
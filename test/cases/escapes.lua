@@ -0,0 +1,4 @@
+print("a\x22\x22\x22b")
+print('a\x22\x22\x22b')
+print("c\x2A/d")
+print("e]=\x3D=]f")
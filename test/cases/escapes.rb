@@ -0,0 +1,4 @@
+puts "a\x22\x22\x22b"
+puts %Q(a\x22\x22\x22b)
+puts "c\x2A/d"
+puts "e]=\x3D=]f"
@@ -1,7 +1,14 @@
+import argparse
+import hashlib
+import json
 import os
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 
 if (cwd := os.getcwd()) not in sys.path:
@@ -9,7 +16,9 @@ if (cwd := os.getcwd()) not in sys.path:
     if (script_path := os.path.dirname(os.path.abspath(__file__))) in sys.path:
             sys.path.remove(script_path)
 
-from main import create_zipper
+from bench import generators
+from main import Source, create_zipper, iter_zipper, read_source
+from misc import checker_pool, minimizer, plan, stats, syntax_checker, watch
 
 
 #
@@ -18,21 +27,192 @@ from main import create_zipper
 # Goes through every file in cases, finds those that have the same name, zips them, runs them and compares outputs.
 # Not great, but good as a temporary solution.
 #
+# Cases (and the interpreters each of them runs) go through a pool of workers (`--workers`), every interpreter
+# invocation is killed after `--timeout` seconds, and the outputs of the original programs are cached by file hash and
+# interpreter (resolved path, size and mtime), across template combinations and across runs (`--no-cache` to skip
+# it). The cache lives next to this script, so every checkout keeps its own.
+#
 # Needs `node` and `python3` to run.
 #
 
+engine_settings = {
+    'workers': os.cpu_count() or 1,
+    'timeout': 30.0,
+    'cache': os.path.join(os.path.dirname(os.path.abspath(__file__)), ".qnd_test_outputs.json"),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(kind):
+    # One pool per kind of task, so tasks waiting on others never starve the pool they are waiting on
+    with _executors_lock:
+        if kind not in _executors:
+            _executors[kind] = ThreadPoolExecutor(max_workers=engine_settings['workers'],
+                                                  thread_name_prefix=f"test-{kind}")
+        return _executors[kind]
+
 
 def get_script_files(directory, extension):
     return {f[:-len(extension)] for f in os.listdir(directory) if f.endswith(extension)}
 
 def run_script(command):
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True)
-        return result.stdout.strip()
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   start_new_session=True)
+    except Exception as e:
+        return str(e)
+    try:
+        stdout, _ = process.communicate(timeout=engine_settings['timeout'])
+        return stdout.strip()
+    except subprocess.TimeoutExpired as e:
+        # The whole session goes, not just the shell: the interpreter (or the shim it went through) is in there too
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.communicate()
+        return f"TIMEOUT: '{e.cmd}' took longer than {e.timeout}s"
     except Exception as e:
+        process.kill()
+        process.communicate()
         return str(e)
 
 
+class OutputCache:
+    def __init__(self, path):
+        self.path = path
+        self._outputs = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._interpreters = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as cache_file:
+                    self._outputs = json.load(cache_file)
+            except (OSError, ValueError):
+                self._outputs = {}
+
+    def run(self, interpreter, path):
+        """Runs an original program, unless the same interpreter already ran a file with the same contents."""
+        with self._lock:
+            if interpreter not in self._interpreters:
+                self._interpreters[interpreter] = syntax_checker.executable_version(interpreter)
+            version = self._interpreters[interpreter]
+        with open(path, "rb") as source_file:
+            key = f"{interpreter}:{version}:{hashlib.sha256(source_file.read()).hexdigest()}"
+        with self._lock:
+            if key in self._outputs:
+                return self._outputs[key]
+        output = run_script(f"{interpreter} {path}")
+        if not output.startswith("TIMEOUT: "):
+            with self._lock:
+                self._outputs[key] = output
+                self._dirty = True
+        return output
+
+    def save(self):
+        with self._lock:
+            if not (self.path and self._dirty):
+                return
+            with open(self.path, "w") as cache_file:
+                json.dump(self._outputs, cache_file)
+            self._dirty = False
+
+
+_output_cache = None
+
+
+def get_output_cache():
+    global _output_cache
+    if _output_cache is None:
+        _output_cache = OutputCache(engine_settings['cache'])
+    return _output_cache
+
+
+def compare_case(test_path, file, test_lua, test_ruby):
+    py_path = os.path.join(test_path, file + '.py')
+    js_path = os.path.join(test_path, file + '.js')
+    lua_path = os.path.join(test_path, file + '.lua') if test_lua else ''
+    ruby_path = os.path.join(test_path, file + '.rb') if test_ruby else ''
+
+    template = "templates/"
+    if test_ruby:
+        template += "four.zipped.template"
+    elif test_lua:
+        template += "three.zipped.template"
+    else:
+        template += "two.zipped.template"
+
+    originals = get_output_cache()
+    runner = get_executor("run")
+
+    answer = create_zipper(py_path, js_path,lua_path, ruby_path, template)
+    with tempfile.NamedTemporaryFile(mode='w+', suffix=".txt", delete=False) as temp_file:
+        temp_file.write(answer)
+    try:
+        runs = {
+            "py": runner.submit(originals.run, "python3", py_path),
+            "py_zipped": runner.submit(run_script, f"python3 {temp_file.name}"),
+            "js": runner.submit(originals.run, "node", js_path),
+            "js_zipped": runner.submit(run_script, f"node {temp_file.name}"),
+        }
+        if test_lua:
+            runs["lua"] = runner.submit(originals.run, "lua", lua_path)
+            runs["lua_zipped"] = runner.submit(run_script, f"lua {temp_file.name}")
+        if test_ruby:
+            runs["ruby"] = runner.submit(originals.run, "ruby", ruby_path)
+            runs["ruby_zipped"] = runner.submit(run_script, f"ruby {temp_file.name}")
+        outputs = {name: run.result() for name, run in runs.items()}
+    finally:
+        os.remove(temp_file.name)
+
+    py_output = outputs["py"]
+    py_output_zipped = outputs["py_zipped"]
+    js_output = outputs["js"]
+    js_output_zipped = outputs["js_zipped"]
+    lua_output = outputs.get("lua", py_output)
+    lua_output_zipped = outputs.get("lua_zipped", py_output)
+    ruby_output = outputs.get("ruby", py_output)
+    ruby_output_zipped = outputs.get("ruby_zipped", py_output)
+
+    truths = [py_output == py_output_zipped,
+              js_output == js_output_zipped,
+              py_output == js_output,
+              lua_output == py_output,
+              lua_output == lua_output_zipped,
+              ruby_output == py_output,
+              ruby_output == ruby_output_zipped
+              ]
+
+    if all(truths):
+        return None
+
+    failure = ""
+    if not truths[0]:
+        failure += f"PYTHON MISMATCH FOUND: \nORIGINAL\n\n{py_output}\n\nZIPPED\n\n{py_output_zipped}"
+    if not truths[1]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"JS MISMATCH FOUND: \nORIGINAL\n\n{js_output}\n\nZIPPED\n\n{js_output_zipped}"
+    if not truths[2]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nJAVASCRIPT\n\n{js_output}"
+    if not truths[3]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nLUA\n\n{lua_output}"
+    if not truths[4]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"LUA MISMATCH FOUND: \nORIGINAL\n\n{lua_output}\n\nZIPPED\n\n{lua_output_zipped}"
+    if not truths[5]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nRUBY\n\n{ruby_output}"
+    if not truths[6]:
+        failure += "\n" if len(failure) > 0 else ""
+        failure += f"RUBY MISMATCH FOUND: \nORIGINAL\n\n{ruby_output}\n\nZIPPED\n\n{ruby_output_zipped}"
+    return failure
+
+
 def compare_outputs(test_path, test_lua, test_ruby):
     assert(not test_ruby or test_lua)
 
@@ -52,110 +232,61 @@ def compare_outputs(test_path, test_lua, test_ruby):
     if test_ruby:
         common_files = common_files.intersection(ruby_files)
 
-    for file in sorted(common_files):
-        with tempfile.NamedTemporaryFile(mode='w+', suffix=".txt", delete=False) as temp_file:
-            py_path = os.path.join(test_path, file + '.py')
-            js_path = os.path.join(test_path, file + '.js')
-            lua_path = os.path.join(test_path, file + '.lua') if test_lua else ''
-            ruby_path = os.path.join(test_path, file + '.rb') if test_ruby else ''
-
-            template = "templates/"
-            if test_ruby:
-                template += "four.zipped.template"
-            elif test_lua:
-                template += "three.zipped.template"
-            else:
-                template += "two.zipped.template"
-
-            answer = create_zipper(py_path, js_path,lua_path, ruby_path, template)
-            temp_file.write(answer)
-            temp_file.flush()
-
-            py_output = run_script(f"python3 {py_path}")
-            py_output_zipped = run_script(f"python3 {temp_file.name}")
-            js_output = run_script(f"node {js_path}")
-            js_output_zipped = run_script(f"node {temp_file.name}")
-            lua_output = py_output
-            lua_output_zipped = py_output
-            ruby_output = py_output
-            ruby_output_zipped = py_output
-
-            if test_lua:
-                lua_output = run_script(f"lua {lua_path}")
-                lua_output_zipped = run_script(f"lua {temp_file.name}")
-
-            if test_ruby:
-                ruby_output = run_script(f"ruby {ruby_path}")
-                ruby_output_zipped = run_script(f"ruby {temp_file.name}")
-
-            truths = [py_output == py_output_zipped,
-                      js_output == js_output_zipped,
-                      py_output == js_output,
-                      lua_output == py_output,
-                      lua_output == lua_output_zipped,
-                      ruby_output == py_output,
-                      ruby_output == ruby_output_zipped
-                      ]
+    def run_case(file):
+        try:
+            return compare_case(test_path, file, test_lua, test_ruby)
+        except Exception as e:
+            return f"ZIPPER FAILURE: {type(e).__name__}: {e}"
 
-        if all(truths):
+    files = sorted(common_files)
+    for file, result in zip(files, get_executor("case").map(run_case, files)):
+        if result is None:
             success.append(file)
         else:
-            failure[file] = ""
-            if not truths[0]:
-                failure[file] += f"PYTHON MISMATCH FOUND: \nORIGINAL\n\n{py_output}\n\nZIPPED\n\n{py_output_zipped}"
-            if not truths[1]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"JS MISMATCH FOUND: \nORIGINAL\n\n{js_output}\n\nZIPPED\n\n{js_output_zipped}"
-            if not truths[2]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nJAVASCRIPT\n\n{js_output}"
-            if not truths[3]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nLUA\n\n{lua_output}"
-            if not truths[4]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"LUA MISMATCH FOUND: \nORIGINAL\n\n{lua_output}\n\nZIPPED\n\n{lua_output_zipped}"
-            if not truths[5]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"POLYGLOT MISMATCH FOUND: \nPYTHON\n\n{py_output}\n\nRUBY\n\n{ruby_output}"
-            if not truths[6]:
-                failure[file] += "\n" if len(failure[file]) > 0 else ""
-                failure[file] += f"RUBY MISMATCH FOUND: \nORIGINAL\n\n{ruby_output}\n\nZIPPED\n\n{ruby_output_zipped}"
+            failure[file] = result
 
     return success, failure
 
 
 
-def four_language_templates_test():
+def four_language_templates_test(minimize=False):
     error_code = 0
-    for with_lua in [False, True]:
-        for with_ruby in [False, True]:
-            if with_ruby and not with_lua:
-                continue
-            print(">>>>>>>>>>>>>>>>")
-            if with_ruby:
-                print("> Testing ruby >")
-            elif with_lua:
-                print("> Testing Lua >")
-            else:
-                print("> Testing PY+JS >")
-            print(">>>>>>>>>>>>>>>>")
-            sys.stdout.write("Starting test\n------------\n")
-            success, failure = compare_outputs("test/cases", with_lua, with_ruby)
-            if len(success) > 0:
-                sys.stdout.write("SUCCESS:\n")
-                for case in success:
-                    sys.stdout.write(f"* {case}\n")
-                sys.stdout.write("...\n")
-            sys.stdout.flush()
-            if len(failure) > 0:
-                sys.stderr.write("FAILURE:\n")
-                error_code = 1
-                for case in failure:
-                    sys.stderr.write(f"* {case}\n")
-                    sys.stderr.write(f"{failure[case]}\n")
-            sys.stderr.flush()
-            sys.stdout.write("------------\nTest finished\n")
+    # Every combination runs at once, their reports are still printed in order
+    combinations = [(with_lua, with_ruby) for with_lua in [False, True] for with_ruby in [False, True]
+                    if not (with_ruby and not with_lua)]
+    minimizer.set_minimize(minimize)
+    try:
+        results = [get_executor("combination").submit(compare_outputs, "test/cases", with_lua, with_ruby)
+                   for with_lua, with_ruby in combinations]
+        outcomes = [result.result() for result in results]
+    finally:
+        minimizer.set_minimize(False)
+    for (with_lua, with_ruby), (success, failure) in zip(combinations, outcomes):
+        print(">>>>>>>>>>>>>>>>")
+        label = " (minimized)" if minimize else ""
+        if with_ruby:
+            print(f"> Testing ruby{label} >")
+        elif with_lua:
+            print(f"> Testing Lua{label} >")
+        else:
+            print(f"> Testing PY+JS{label} >")
+        print(">>>>>>>>>>>>>>>>")
+        sys.stdout.write("Starting test\n------------\n")
+        if len(success) > 0:
+            sys.stdout.write("SUCCESS:\n")
+            for case in success:
+                sys.stdout.write(f"* {case}\n")
+            sys.stdout.write("...\n")
+        sys.stdout.flush()
+        if len(failure) > 0:
+            sys.stderr.write("FAILURE:\n")
+            error_code = 1
+            for case in failure:
+                sys.stderr.write(f"* {case}\n")
+                sys.stderr.write(f"{failure[case]}\n")
+        sys.stderr.flush()
+        sys.stdout.write("------------\nTest finished\n")
+    get_output_cache().save()
     return error_code
 
 
@@ -205,22 +336,381 @@ def double_test():
         return 0
 
 
+def lexer_crosscheck_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Lexer Classifier >")
+    syntax_checker.set_classifier("crosscheck")
+    syntax_checker.lexer_mismatches.clear()
+    try:
+        for case in sorted(get_script_files("test/cases", ".rb")):
+            create_zipper(*[f"test/cases/{case}.{ext}" for ext in ["py", "js", "lua", "rb"]],
+                          "templates/four.zipped.template")
+        # Closing a single-quoted `"""` early can still leave valid code behind
+        create_zipper("", "", "", Source("p '\"\"\"' # '\n"), "test/faux_templates/ruby.template")
+    finally:
+        syntax_checker.set_classifier("probe")
+
+    if syntax_checker.lexer_mismatches:
+        print("Lexer decisions differ from the probes")
+        return 4
+    print("Lexer decisions match the probes!")
+    print(">>>>>")
+    return 0
+
+
+def probe_strategy_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Probe Strategies >")
+    answers = {}
+    try:
+        for strategy in syntax_checker.probe_strategies:
+            syntax_checker.set_probe_strategy(strategy)
+            answers[strategy] = [
+                create_zipper(*[f"test/cases/{case}.{ext}" for ext in ["py", "js", "lua", "rb"]],
+                              "templates/four.zipped.template")
+                for case in sorted(get_script_files("test/cases", ".rb"))]
+    finally:
+        syntax_checker.set_probe_strategy("single")
+
+    if any(answer != answers["single"] for answer in answers.values()):
+        print("Probe strategies give different results")
+        return 5
+    print("Probe strategies are equivalent!")
+    print(">>>>>")
+    return 0
+
+
+def window_probe_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Windowed Probes >")
+    template = "templates/four.zipped.template"
+    inputs = [([f"test/cases/{case}.{ext}" for ext in ["py", "js", "lua", "rb"]], template)
+              for case in sorted(get_script_files("test/cases", ".rb"))]
+    # Sources past the default threshold, so windows are used the same way as on the command line
+    inputs += [([Source(generators.GENERATORS[language](20000, 0.3, seed)) for language in generators.GENERATORS],
+                template) for seed in range(2)]
+    # A heredoc body looks like code to anything that cuts it apart from its opening line
+    padding = ''.join(f"x{n} = {n}\n" for n in range(2000))
+    heredoc = Source(padding + "s = <<EOS\np 2 */ 3/\nEOS\nputs s\n" + padding)
+    inputs.append((["", "", "", heredoc], "test/faux_templates/ruby.template"))
+
+    def zip_all():
+        return [create_zipper(*sources, template) for sources, template in inputs]
+
+    whole = zip_all()
+    threshold = syntax_checker.probe_settings['window_threshold']
+    try:
+        syntax_checker.set_windowed_probes(True)
+        windowed = zip_all()
+        # Every case windowed, however small
+        syntax_checker.set_windowed_probes(True, 0)
+        windowed_small = zip_all()
+    finally:
+        syntax_checker.set_windowed_probes(False, threshold)
+
+    if windowed != whole or windowed_small != whole:
+        print("Windowed probes give different results")
+        return 7
+    print("Windowed probes are equivalent!")
+    print(">>>>>")
+    return 0
+
+
+def watch_rebuild_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Watched Rebuilds >")
+    template = "templates/four.zipped.template"
+    filler = ''.join(f"x{n} = {n}\n" for n in range(5))
+    python_code = f"a = 1\n{filler}ruby_long_string = 2\n{filler}b = 3\nprint(ruby_long_string)\n"
+    ruby_code = f"a = 1\n{filler}p '\"\"\"', '*/'\n{filler}b = 3\n"
+    # (python, ruby) before and after the edit. The first edits turn the lines in between into a string.
+    edits = [
+        ((python_code, ""), (python_code.replace("a = 1", 'a = """').replace("b = 3", 'b = """'), "")),
+        (("", ruby_code), ("", ruby_code.replace("a = 1", "a = %q(").replace("b = 3", ")"))),
+        ((python_code, ruby_code), (python_code.replace("a = 1", "a = 5"), ruby_code.replace("b = 3", "b = 5"))),
+    ]
+
+    def zip_sources(python, ruby):
+        return create_zipper(Source(python), Source(""), Source(""), Source(ruby), template)
+
+    failed = False
+    for before, after in edits:
+        store = watch.enable_decision_store()
+        try:
+            store.begin_build()
+            zip_sources(*before)
+            store.begin_build()
+            watched = zip_sources(*after)
+        finally:
+            watch.disable_decision_store()
+        if watched != zip_sources(*after):
+            failed = True
+    # Edits that leave the rest of the file alone still reuse decisions
+    if failed or not store.reused:
+        print("Watched rebuilds differ from fresh builds")
+        return 8
+    print("Watched rebuilds match fresh builds!")
+    print(">>>>>")
+    return 0
+
+
+def stream_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Streamed Zips >")
+    templates = [("templates/two.zipped.template", 2), ("templates/three.zipped.template", 3),
+                 ("templates/four.zipped.template", 4)]
+    extensions = ["py", "js", "lua", "rb"]
+    with tempfile.TemporaryDirectory() as directory:
+        # Only files on disk are streamed. Larger sources, and sources that have to take the probed path anyway:
+        # `\r\n` newlines, and `ruby_long_string` in every section (the generated ones carry it too).
+        cases = [[f"test/cases/{case}.{ext}" for ext in extensions]
+                 for case in sorted(get_script_files("test/cases", ".rb"))]
+        for name, sources in [
+                ("generated", [generators.GENERATORS[language](8000, 0.3, 0) for language in generators.GENERATORS]),
+                ("crlf", ["print('*/')\r\n", "console.log('*/')\r\n", "print('*/')\r\n", "puts '*/'\r\n"]),
+                ("plain", ["print('*/ ]===]')\n", "console.log('\"\"\"')\n", "print('*/')\n", "puts 1\n"])]:
+            paths = [os.path.join(directory, f"{name}.{ext}") for ext in extensions]
+            for path, source in zip(paths, sources):
+                with open(path, "w", newline="") as source_file:
+                    source_file.write(source)
+            cases.append(paths)
+
+        failed = []
+        for paths in cases:
+            for template, count in templates:
+                sources = paths[:count] + [""] * (len(paths) - count)
+                streamed = b"".join(iter_zipper(*sources, template))
+                if streamed != create_zipper(*sources, template).encode("utf-8", "surrogateescape"):
+                    failed.append(f"{os.path.basename(paths[0])} ({os.path.basename(template)})")
+
+    if failed:
+        print(f"Streamed zips differ from whole ones: {', '.join(failed)}")
+        return 9
+    print("Streamed zips are byte-identical!")
+    print(">>>>>")
+    return 0
+
+
+def plan_replay_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Plan Replays >")
+    template = "templates/four.zipped.template"
+    inputs = [[f"test/cases/{case}.{ext}" for ext in ["py", "js", "lua", "rb"]]
+              for case in sorted(get_script_files("test/cases", ".rb"))]
+    inputs += [[Source(generators.GENERATORS[language](8000, 0.3, seed)) for language in generators.GENERATORS]
+               for seed in range(2)]
+    checks = []
+
+    def count_checks(event, data):
+        if event == "check":
+            checks.append(data["language"])
+
+    failed = []
+    for sources in inputs:
+        name = "generated" if isinstance(sources[0], Source) else os.path.basename(sources[0])
+        with plan.using_plan(plan.EscapePlan()) as recorded:
+            zipped = create_zipper(*sources, template)
+        # Through JSON, the same way `--plan-out` and `--plan-in` pass it along
+        data = json.loads(recorded.to_json())
+        # Replays don't compile anything, whatever way of probing is set (windows compile a whole stage up front)
+        threshold = syntax_checker.probe_settings['window_threshold']
+        for strategy, window in [("single", False), ("single", True), ("bisect", False)]:
+            checks.clear()
+            stats.subscribe(count_checks)
+            try:
+                syntax_checker.set_probe_strategy(strategy)
+                syntax_checker.set_windowed_probes(window, 0)
+                with plan.using_plan(plan.EscapePlan(data)):
+                    replayed = create_zipper(*sources, template)
+            finally:
+                stats.unsubscribe(count_checks)
+                syntax_checker.set_probe_strategy("single")
+                syntax_checker.set_windowed_probes(False, threshold)
+            if replayed != zipped or checks:
+                failed.append(f"{name} (replayed differently with {strategy}{' windows' if window else ''}, "
+                              f"{len(checks)} checks)")
+
+        # A source edited since the plan was written is turned away
+        edited = [Source(read_source(sources[0]) + "edited = 1\n")] + sources[1:]
+        try:
+            with plan.using_plan(plan.EscapePlan(data)):
+                create_zipper(*edited, template)
+            failed.append(f"{name} (edited source replayed)")
+        except Exception as e:
+            if not str(e).startswith("PLAN ERROR"):
+                failed.append(f"{name} (edited source: {e})")
+
+    # Minimizing decisions are replayed too, a plan written without them is turned away
+    minimizer.set_minimize(True)
+    try:
+        for sources in [sources for sources in inputs if not isinstance(sources[0], Source)]:
+            name = f"{os.path.basename(sources[0])} minimized"
+            with plan.using_plan(plan.EscapePlan()) as recorded:
+                zipped = create_zipper(*sources, template)
+            checks.clear()
+            stats.subscribe(count_checks)
+            try:
+                with plan.using_plan(plan.EscapePlan(json.loads(recorded.to_json()))):
+                    replayed = create_zipper(*sources, template)
+            finally:
+                stats.unsubscribe(count_checks)
+            if replayed != zipped or checks:
+                failed.append(f"{name} (replayed differently, {len(checks)} checks)")
+        try:
+            with plan.using_plan(plan.EscapePlan(data)):
+                create_zipper(*inputs[-1], template)
+            failed.append("generated (plan without minimizing decisions replayed)")
+        except Exception as e:
+            if not str(e).startswith("PLAN ERROR"):
+                failed.append(f"generated (plan without minimizing decisions: {e})")
+    finally:
+        minimizer.set_minimize(False)
+
+    if failed:
+        print(f"Plans don't replay: {', '.join(failed)}")
+        return 10
+    print("Plans replay without a single check!")
+    print(">>>>>")
+    return 0
+
+
+def minimized_comments_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Minimized Comments >")
+    # (source, comments that have to stay) for each language, every `dropped` comment has to go
+    sections = [
+        ("#!/usr/bin/env python3\n# -*- coding: utf-8 -*-\n# dropped\nprint('*/')\n",
+         ["#!/usr/bin/env python3", "# -*- coding: utf-8 -*-"]),
+        ("/*! kept license */\n// dropped\n/* dropped */\nconsole.log('*/')\n", ["/*! kept license */"]),
+        ("--[[! kept license ]]\n-- dropped\nprint(']===]')\n", ["--[[! kept license ]]"]),
+        ("# frozen_string_literal: true\n# encoding: utf-8\n# dropped\nputs '*/'\n",
+         ["# frozen_string_literal: true", "# encoding: utf-8"]),
+    ]
+    minimizer.set_minimize(True)
+    try:
+        zipped = create_zipper(*[Source(source) for source, _ in sections], "templates/four.zipped.template")
+        escapes = create_zipper(*[f"test/cases/escapes.{ext}" for ext in ["py", "js", "lua", "rb"]],
+                                "templates/four.zipped.template")
+    finally:
+        minimizer.set_minimize(False)
+
+    missing = [comment for _, comments in sections for comment in comments if comment not in zipped]
+    if missing or "dropped" in zipped:
+        print(f"Minimized zips lost comments that mean something ({missing}) or kept others")
+        return 11
+    # The other sections sit inside Python strings, a shortened escape Python doesn't know warns on every run
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            compile(escapes, "<minimized>", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        print(f"Minimized zips hold escapes Python warns about ({e})")
+        return 11
+    print("Minimized zips keep the comments that mean something!")
+    print(">>>>>")
+    return 0
+
+
+# Answers the start-up ping and dies on the first real check, like a worker that keeps crashing
+_CRASHING_WORKER = r"""
+import sys
+while True:
+    size = int(sys.stdin.buffer.readline() or 0)
+    if size:
+        sys.exit(1)
+    sys.stdout.write("1\n")
+    sys.stdout.flush()
+"""
+
+
+def checker_pool_crash_test():
+    print("::::::::::::::::")
+    print(">>>>>>>>>>>>>>>>")
+    print("> Testing Checker Pool Crashes >")
+    pool = checker_pool.CheckerPool([sys.executable, "-c", _CRASHING_WORKER], 1)
+    errors = []
+
+    def check():
+        try:
+            pool.check("x = 1")
+        except checker_pool.WorkerError as e:
+            # What the syntax checker does: give up on the pool and fall back to one process per check
+            errors.append(e)
+            pool.close()
+
+    threads = [threading.Thread(target=check, daemon=True) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=engine_settings['timeout'])
+
+    if any(thread.is_alive() for thread in threads) or len(errors) != len(threads):
+        print("Checks waiting on a broken checker pool never returned")
+        return 6
+    print("Checks waiting on a broken checker pool fall back!")
+    print(">>>>>")
+    return 0
+
+
+def get_input():
+    parser = argparse.ArgumentParser(description="Zips every test case, runs it and compares the outputs.")
+    parser.add_argument("language", nargs="?", default=None,
+                        help="Display the zipped edge cases for one language (or all) instead of testing")
+    parser.add_argument("--workers", type=int, default=engine_settings['workers'],
+                        help="Number of cases (and interpreter invocations) running concurrently")
+    parser.add_argument("--timeout", type=float, default=engine_settings['timeout'],
+                        help="Seconds before an interpreter invocation is killed")
+    parser.add_argument("--no-cache", action="store_true", help="Don't reuse the outputs of the original programs")
+    args = parser.parse_args()
+    engine_settings['workers'] = max(1, args.workers)
+    engine_settings['timeout'] = args.timeout
+    if args.no_cache:
+        engine_settings['cache'] = None
+    return args.language
+
+
 if __name__ == "__main__":
-    if len(sys.argv) <= 1:
+    language = get_input()
+    if language is None:
         error_code = four_language_templates_test()
+        if not error_code:
+            error_code = four_language_templates_test(minimize=True)
+        if not error_code:
+            error_code = minimized_comments_test()
         if not error_code:
             error_code = double_test()
+        if not error_code:
+            error_code = lexer_crosscheck_test()
+        if not error_code:
+            error_code = probe_strategy_test()
+        if not error_code:
+            error_code = window_probe_test()
+        if not error_code:
+            error_code = watch_rebuild_test()
+        if not error_code:
+            error_code = stream_test()
+        if not error_code:
+            error_code = plan_replay_test()
+        if not error_code:
+            error_code = checker_pool_crash_test()
         exit(error_code)
     else:
-        if sys.argv[1] == "python":
+        if language == "python":
             print(create_zipper("test/cases/edgecases.py","","","","test/faux_templates/python.template"))
-        if sys.argv[1] == "javascript":
+        if language == "javascript":
             print(create_zipper("","test/cases/edgecases.js","","","test/faux_templates/js.template"))
-        if sys.argv[1] == "lua":
+        if language == "lua":
             print(create_zipper("","","test/cases/edgecases.lua","","test/faux_templates/lua.template"))
-        if sys.argv[1] == "ruby":
+        if language == "ruby":
             print(create_zipper("","","","test/cases/edgecases.rb","test/faux_templates/ruby.template"))
-        if sys.argv[1] == "all":
+        if language == "all":
             print(create_zipper("test/cases/edgecases.py",
                                 "test/cases/edgecases.js",
                                 "test/cases/edgecases.lua",